@@ -1,8 +1,88 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, CallbackQueryHandler
-from database import db
+from database import async_db
+from user_management import expiry_timers
+from outbox import outbox_delivery, notify, invite
+from config import PENDING_PAGE_SIZE
 from datetime import datetime, timedelta
 
+APPROVED_TEXT = (
+    "🎉 Your payment has been approved! You now have 30 days access to our premium channel.\n\n"
+    "⚠️ Note: After 30 days, you must complete a new payment and approval process to continue access."
+)
+REJECTED_TEXT = "❌ Your payment was rejected. Please check your credentials and try again, or contact support."
+# Deciding from /approvals overrides whichever reviewer holds the submission
+RELEASE_CLAIM = {'claimed_by': None, 'claim_expires_at': None}
+
+def decision_notices(approve):
+    # outbox_for for decide_pending: what each decided user is sent
+    if approve:
+        return lambda user_id: [invite(user_id, APPROVED_TEXT, 'approved')]
+    return lambda user_id: [notify(user_id, REJECTED_TEXT, 'rejected')]
+
+async def approve_user(user_id):
+    # Returns (user_id, username) and the subscription end, or None if the user doesn't
+    # exist or was already decided; a repeated tap stops at the conditional UPDATE
+    subscription_end = datetime.now() + timedelta(days=30)
+    decided = await async_db.decide_pending([user_id], {
+        'is_approved': True,
+        'is_banned': False,
+        'subscription_end': subscription_end,
+        **RELEASE_CLAIM
+    }, outbox_for=decision_notices(True))
+    if not decided:
+        return None
+    expiry_timers.arm(user_id, subscription_end)
+    outbox_delivery.wake()
+    
+    return decided[0], subscription_end
+
+async def reject_user(user_id):
+    # Returns (user_id, username), or None if the user doesn't exist or was already decided
+    decided = await async_db.decide_pending([user_id], {
+        'is_approved': False,
+        'is_banned': True,
+        **RELEASE_CLAIM
+    }, outbox_for=decision_notices(False))
+    if not decided:
+        return None
+    expiry_timers.disarm(user_id)
+    outbox_delivery.wake()
+    
+    return decided[0]
+
+async def bulk_decide(user_ids, approve):
+    # Approve or reject many pending users in one transaction, which also queues their
+    # channel adds and notifications for the outbox. None if the update failed.
+    if approve:
+        subscription_end = datetime.now() + timedelta(days=30)
+        values = {'is_approved': True, 'is_banned': False, 'subscription_end': subscription_end, **RELEASE_CLAIM}
+    else:
+        values = {'is_approved': False, 'is_banned': True, **RELEASE_CLAIM}
+    
+    decided = await async_db.decide_pending(user_ids, values, outbox_for=decision_notices(approve))
+    if decided is None:
+        return None
+    for user_id, _ in decided:
+        if approve:
+            expiry_timers.arm(user_id, subscription_end)
+        else:
+            expiry_timers.disarm(user_id)
+    if decided:
+        outbox_delivery.wake()
+    
+    return {'decided': len(decided), 'skipped': len(set(user_ids)) - len(decided)}
+
+def summary_text(summary, approve):
+    if summary is None:
+        return "❌ Could not update the selected users.\n\n"
+    text = f"{'✅ Approved' if approve else '❌ Rejected'} {summary['decided']} user(s)"
+    if summary['skipped']:
+        text += f", {summary['skipped']} already handled"
+    if summary['decided']:
+        text += "\n📬 Notifications queued"
+    return text + "\n\n"
+
 async def admin_approval_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -14,40 +94,13 @@ async def admin_approval_callback(update: Update, context: ContextTypes.DEFAULT_
     
     action, user_id = query.data.split('_')
     user_id = int(user_id)
-    target_user = db.get_user(user_id)
-    
-    if not target_user:
-        await query.edit_message_text("❌ User not found in database.")
-        return
     
     if action == 'approve':
-        # Set NEW 30-day subscription
-        subscription_end = datetime.now() + timedelta(days=30)
-        
-        db.update_user(user_id, {
-            'is_approved': True,
-            'is_banned': False,
-            'subscription_end': subscription_end
-        })
-        
-        # Add user to channel
-        try:
-            await context.bot.add_chat_member(
-                chat_id=context.bot_data['channel_id'],
-                user_id=user_id
-            )
-        except Exception as e:
-            print(f"Error adding user to channel: {e}")
-        
-        # Notify user
-        try:
-            await context.bot.send_message(
-                chat_id=user_id,
-                text="🎉 Your payment has been approved! You now have 30 days access to our premium channel.\n\n"
-                     "⚠️ Note: After 30 days, you must complete a new payment and approval process to continue access."
-            )
-        except Exception as e:
-            print(f"Error notifying user: {e}")
+        approved = await approve_user(user_id)
+        if not approved:
+            await query.edit_message_text("❌ User not found or already handled.")
+            return
+        target_user, subscription_end = approved
         
         await query.edit_message_text(
             f"✅ User @{target_user.username} approved successfully!\n"
@@ -56,20 +109,10 @@ async def admin_approval_callback(update: Update, context: ContextTypes.DEFAULT_
         )
         
     elif action == 'reject':
-        # Reject user and mark as banned
-        db.update_user(user_id, {
-            'is_approved': False,
-            'is_banned': True
-        })
-        
-        # Notify user
-        try:
-            await context.bot.send_message(
-                chat_id=user_id,
-                text="❌ Your payment was rejected. Please check your credentials and try again, or contact support."
-            )
-        except Exception as e:
-            print(f"Error notifying user: {e}")
+        target_user = await reject_user(user_id)
+        if not target_user:
+            await query.edit_message_text("❌ User not found or already handled.")
+            return
         
         await query.edit_message_text(
             f"❌ User @{target_user.username} rejected and banned.\n"
@@ -81,17 +124,17 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Only the admin can view statistics.")
         return
     
-    users = db.get_all_users()
-    active_users = [u for u in users if u.is_subscription_active()]
-    pending_approvals = db.get_pending_approvals()
-    banned_users = db.get_banned_users()
+    counts = await async_db.get_stats()
+    if not counts:
+        await update.message.reply_text("❌ Could not load statistics.")
+        return
     
     stats_text = f"""
 📊 Bot Statistics:
-├─ Total Users: {len(users)}
-├─ Active Subscriptions: {len(active_users)}
-├─ Pending Approvals: {len(pending_approvals)}
-└─ Banned Users: {len(banned_users)}
+├─ Total Users: {counts['total']}
+├─ Active Subscriptions: {counts['active']}
+├─ Pending Approvals: {counts['pending']}
+└─ Banned Users: {counts['banned']}
 
 👑 Admin Commands:
 ├─ /approvals - Show pending approvals
@@ -101,44 +144,130 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(stats_text)
 
+def encode_cursor(user):
+    # Keyset position of a pending user, compact enough for callback_data
+    return f"{user.created_at.strftime('%Y%m%d%H%M%S%f')}.{user.id}"
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    stamp, row_id = cursor.split('.')
+    return datetime.strptime(stamp, '%Y%m%d%H%M%S%f'), int(row_id)
+
+async def render_pending_page(cursor=None, direction='from', notice='', selected=frozenset()):
+    users, has_prev, has_next = await async_db.get_pending_page(decode_cursor(cursor), direction, PENDING_PAGE_SIZE)
+    
+    if not users:
+        return f"{notice}✅ No pending approvals.", None
+    
+    total = await async_db.count_pending_approvals()
+    page_cursor = encode_cursor(users[0])
+    
+    lines = [f"{notice}📋 Pending approvals ({total}):", ""]
+    keyboard = []
+    for number, user in enumerate(users, 1):
+        mark = "☑️" if user.user_id in selected else "⬜"
+        lines.append(
+            f"{number}. {mark} @{user.username} - {user.full_name}\n"
+            f"   ID: {user.user_id} | Submitted: {user.created_at.strftime('%Y-%m-%d %H:%M')}"
+        )
+        keyboard.append([
+            InlineKeyboardButton(f"✅ {number}", callback_data=f"pending:approve:{user.user_id}:{page_cursor}"),
+            InlineKeyboardButton(f"❌ {number}", callback_data=f"pending:reject:{user.user_id}:{page_cursor}"),
+            InlineKeyboardButton(f"{mark} {number}", callback_data=f"pending:select:{user.user_id}:{page_cursor}")
+        ])
+    
+    keyboard.append([
+        InlineKeyboardButton("✅ Approve page", callback_data=f"pending:approve_page:{page_cursor}"),
+        InlineKeyboardButton("❌ Reject page", callback_data=f"pending:reject_page:{page_cursor}")
+    ])
+    if selected:
+        keyboard.append([
+            InlineKeyboardButton(f"✅ Selected ({len(selected)})", callback_data=f"pending:approve_selected:{page_cursor}"),
+            InlineKeyboardButton(f"❌ Selected ({len(selected)})", callback_data=f"pending:reject_selected:{page_cursor}"),
+            InlineKeyboardButton("✖️ Clear", callback_data=f"pending:clear:{page_cursor}")
+        ])
+    
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"pending:prev:{page_cursor}"))
+    if has_next:
+        navigation.append(InlineKeyboardButton("Next ➡️", callback_data=f"pending:next:{encode_cursor(users[-1])}"))
+    if navigation:
+        keyboard.append(navigation)
+    
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
 async def show_pending_approvals(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != context.bot_data['admin_id']:
         await update.message.reply_text("❌ Only the admin can view pending approvals.")
         return
     
-    pending_users = db.get_pending_approvals()
+    # One message per page, edited in place by pending_page_callback
+    selected = context.user_data.get('pending_selection', set())
+    text, reply_markup = await render_pending_page(selected=selected)
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+async def pending_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
     
-    if not pending_users:
-        await update.message.reply_text("✅ No pending approvals.")
+    if query.from_user.id != context.bot_data['admin_id']:
+        await query.message.reply_text("❌ Only the admin can review pending approvals.")
         return
     
-    await update.message.reply_text(f"📋 Found {len(pending_users)} pending approval(s):")
+    # pending:<next|prev|approve_page|reject_page|approve_selected|reject_selected|clear>:<cursor>
+    # or pending:<approve|reject|select>:<user_id>:<cursor>
+    parts = query.data.split(':')
+    action = parts[1]
+    notice = ''
+    # Users ticked for a bulk action, kept across pages
+    selected = context.user_data.setdefault('pending_selection', set())
     
-    for user in pending_users:
-        keyboard = [
-            [
-                InlineKeyboardButton("✅ Approve", callback_data=f"approve_{user.user_id}"),
-                InlineKeyboardButton("❌ Reject", callback_data=f"reject_{user.user_id}")
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        text = (
-            f"🆕 Pending Approval:\n"
-            f"├─ User: @{user.username}\n"
-            f"├─ Name: {user.full_name}\n"
-            f"├─ ID: {user.user_id}\n"
-            f"└─ Submitted: {user.created_at.strftime('%Y-%m-%d %H:%M')}"
-        )
-        
-        await update.message.reply_text(text, reply_markup=reply_markup)
+    if action in ('approve', 'reject', 'select'):
+        user_id = int(parts[2])
+        cursor, direction = parts[3], 'from'
+        if action == 'approve':
+            approved = await approve_user(user_id)
+            notice = f"✅ Approved @{approved[0].username}\n\n" if approved else "❌ User not found or already handled.\n\n"
+            selected.discard(user_id)
+        elif action == 'reject':
+            rejected = await reject_user(user_id)
+            notice = f"❌ Rejected @{rejected.username}\n\n" if rejected else "❌ User not found or already handled.\n\n"
+            selected.discard(user_id)
+        elif user_id in selected:
+            selected.discard(user_id)
+        else:
+            selected.add(user_id)
+    elif action in ('approve_page', 'reject_page', 'approve_selected', 'reject_selected'):
+        cursor, direction = parts[2], 'from'
+        if action.endswith('_page'):
+            users, _, _ = await async_db.get_pending_page(decode_cursor(cursor), 'from', PENDING_PAGE_SIZE)
+            user_ids = [user.user_id for user in users]
+        else:
+            user_ids = list(selected)
+        if user_ids:
+            approve = action.startswith('approve')
+            notice = summary_text(await bulk_decide(user_ids, approve), approve)
+            selected.difference_update(user_ids)
+    elif action == 'clear':
+        cursor, direction = parts[2], 'from'
+        selected.clear()
+    else:
+        cursor, direction = parts[2], action
+    
+    text, reply_markup = await render_pending_page(cursor, direction, notice, selected)
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    except Exception as e:
+        print(f"Error updating pending page: {e}")
 
 async def show_banned_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != context.bot_data['admin_id']:
         await update.message.reply_text("❌ Only the admin can view banned users.")
         return
     
-    banned_users = db.get_banned_users()
+    banned_users = await async_db.get_banned_users()
     
     if not banned_users:
         await update.message.reply_text("✅ No banned users.")
@@ -0,0 +1,54 @@
+import contextlib
+import os
+import resource
+import socket
+import sys
+import tempfile
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def bench_env(port, rate_limited=False):
+    # Environment for a bot talking to the stand-in API. Must be applied before
+    # anything imports config; spawned processes inherit it.
+    workdir = tempfile.mkdtemp(prefix='bot-bench-')
+    os.environ.update({
+        'BOT_TOKEN': '123456:bench',
+        'ADMIN_ID': '1',
+        'CHANNEL_ID': '-1001',
+        'BOT_API_URL': f"http://127.0.0.1:{port}",
+        'RATE_LIMITER_ENABLED': 'true' if rate_limited else 'false',
+        'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        'PROOF_STORAGE_DIR': os.path.join(workdir, 'uploads'),
+    })
+    return workdir
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+@contextlib.contextmanager
+def quiet_stdout(enabled=True):
+    # The handlers print per update; keep that out of the report (and out of child processes)
+    if not enabled:
+        yield
+        return
+    sys.stdout.flush()
+    saved = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.close(devnull)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
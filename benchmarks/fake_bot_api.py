@@ -0,0 +1,164 @@
+# Stand-in Bot API server for load tests: answers every method the way Telegram
+# would, minus the network. Latency and 429 flood errors can be injected. Point the
+# bot at it with
+#   BOT_API_URL=http://127.0.0.1:8081 RATE_LIMITER_ENABLED=false
+#
+#   python -m benchmarks.fake_bot_api --port 8081 --latency 0.05 --flood-rate 0.01
+#
+# Updates POSTed to /updates (a JSON list) are served to the bot through getUpdates.
+import argparse
+import asyncio
+import hashlib
+import io
+import itertools
+import json
+import random
+import time
+from aiohttp import web
+try:
+    from PIL import Image, ImageDraw
+except ImportError:
+    Image = None
+
+class FakeBotAPI:
+    def __init__(self, latency=0.0, jitter=0.0, flood_rate=0.0, retry_after=1, file_size=50 * 1024):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.file_size = file_size
+        self.calls = {}
+        self.floods = 0
+        self.message_ids = itertools.count(1)
+        self.updates = []
+        self.updates_ready = asyncio.Event()
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+
+        if method == 'getUpdates':
+            return web.json_response({'ok': True, 'result': await self.get_updates(params)})
+
+        delay = self.latency + random.uniform(0, self.jitter) if self.jitter else self.latency
+        if delay:
+            await asyncio.sleep(delay)
+        if self.flood_rate and random.random() < self.flood_rate:
+            self.floods += 1
+            return web.json_response({
+                'ok': False,
+                'error_code': 429,
+                'description': f"Too Many Requests: retry after {self.retry_after}",
+                'parameters': {'retry_after': self.retry_after}
+            }, status=429)
+        return web.json_response({'ok': True, 'result': self.result(method, params)})
+
+    async def get_updates(self, params):
+        # Long polling: confirm everything below offset, wait up to `timeout` for more
+        offset = int(params.get('offset') or 0)
+        self.updates = [u for u in self.updates if u['update_id'] >= offset]
+        if not self.updates:
+            self.updates_ready.clear()
+            try:
+                await asyncio.wait_for(self.updates_ready.wait(), timeout=float(params.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:int(params.get('limit') or 100)]
+
+    async def add_updates(self, request):
+        self.updates.extend(await request.json())
+        self.updates_ready.set()
+        return web.json_response({'queued': len(self.updates)})
+
+    def result(self, method, params):
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot',
+                    'can_join_groups': True, 'can_read_all_group_messages': False, 'supports_inline_queries': False}
+        if method == 'getFile':
+            file_id = params.get('file_id', 'file')
+            return {'file_id': file_id, 'file_unique_id': file_id[:16], 'file_size': self.file_size,
+                    'file_path': f"photos/{file_id}.jpg"}
+        if method == 'createChatInviteLink':
+            return {'invite_link': f"https://t.me/+bench{next(self.message_ids)}", 'is_primary': False,
+                    'is_revoked': False, 'creates_join_request': False,
+                    'creator': {'id': 1, 'is_bot': True, 'first_name': 'Bench'},
+                    'member_limit': int(params.get('member_limit', 0)) or None}
+        if method.startswith('send') or method in ('copyMessage', 'forwardMessage'):
+            chat_id = params.get('chat_id', 0)
+            try:
+                chat = {'id': int(chat_id), 'type': 'private' if int(chat_id) > 0 else 'supergroup'}
+            except (TypeError, ValueError):
+                chat = {'id': -1, 'type': 'channel', 'username': str(chat_id).lstrip('@')}
+            message = {'message_id': next(self.message_ids), 'date': int(time.time()), 'chat': chat}
+            if 'text' in params:
+                message['text'] = params['text']
+            if method == 'sendVideo':
+                # A file_id comes back as itself; an upload or URL gets a new one
+                video = params.get('video')
+                file_id = video if isinstance(video, str) and '/' not in video else f"video-{message['message_id']}"
+                message['video'] = {'file_id': file_id, 'file_unique_id': file_id[-16:], 'width': 1280,
+                                    'height': 720, 'duration': 30}
+            if 'caption' in params:
+                message['caption'] = params['caption']
+            return message
+        # setWebhook, answerCallbackQuery, banChatMember, edits without a result, ...
+        return True
+
+    async def download(self, request):
+        # Same bytes for the same path, so content addressing sees duplicates as duplicates
+        seed = hashlib.sha256(request.match_info['path'].encode()).digest()
+        if Image is None:
+            body = (seed * (self.file_size // len(seed) + 1))[:self.file_size]
+        else:
+            body = self.receipt(seed)
+        return web.Response(body=body, content_type='image/jpeg')
+
+    def receipt(self, seed):
+        # A decodable screenshot-like JPEG, so the bot's duplicate check does real work
+        rng = random.Random(seed)
+        image = Image.new('RGB', (540, 960), 'white')
+        draw = ImageDraw.Draw(image)
+        for _ in range(20):
+            top = rng.randint(0, 920)
+            draw.rectangle([rng.randint(0, 270), top, rng.randint(270, 540), top + rng.randint(8, 40)],
+                           fill=tuple(rng.randint(0, 255) for _ in range(3)))
+        out = io.BytesIO()
+        image.save(out, 'JPEG', quality=80)
+        return out.getvalue()
+
+    async def stats(self, request):
+        return web.json_response({'calls': self.calls, 'floods': self.floods})
+
+    def make_app(self):
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_get('/calls', self.stats)
+        app.router.add_post('/updates', self.add_updates)
+        app.router.add_get('/file/bot{token}/{path:.+}', self.download)
+        app.router.add_route('*', '/bot{token}/{method}', self.handle)
+        return app
+
+def serve(host, port, latency=0.0, jitter=0.0, flood_rate=0.0, retry_after=1):
+    async def make_app():
+        # Built inside the server's loop so the getUpdates event binds to it
+        return FakeBotAPI(latency, jitter, flood_rate, retry_after).make_app()
+    # reuse_port lets several of these share one port
+    web.run_app(make_app(), host=host, port=port, reuse_port=True, print=None, access_log=None)
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Telegram Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every call")
+    parser.add_argument('--jitter', type=float, default=0.0, help="up to this many extra seconds, at random")
+    parser.add_argument('--flood-rate', type=float, default=0.0, help="fraction of calls answered with 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="retry_after sent with each 429")
+    args = parser.parse_args()
+    print(json.dumps({'listening': f"http://{args.host}:{args.port}"}))
+    serve(args.host, args.port, args.latency, args.jitter, args.flood_rate, args.retry_after)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+# End-to-end benchmarks: the real bot.py handlers and subscription sweep, talking to
+# the stand-in Bot API in benchmarks/fake_bot_api.py.
+#
+#   python -m benchmarks.suite                                   # every scenario
+#   python -m benchmarks.suite --scenarios start,submit --users 5000 --latency 0.05
+#   python -m benchmarks.suite --save benchmarks/baselines/main.json
+#   python -m benchmarks.suite --compare benchmarks/baselines/main.json
+#
+# Scenarios:
+#   start    /start storm from --users users, most of them new
+#   submit   payment photo followed by the name, per user
+#   approve  the admin approving every submission
+#   sweep    check_subscriptions over --sweep-users seeded users, then again with nothing due
+import argparse
+import asyncio
+import json
+import multiprocessing
+import platform
+import random
+import time
+from datetime import datetime, timedelta
+from benchmarks.common import free_port, bench_env, percentile, peak_rss_mb, quiet_stdout
+
+SCENARIOS = ['start', 'submit', 'approve', 'sweep']
+ADMIN_USER_ID = 1
+FIRST_USER_ID = 100000
+
+def message_update(update_id, user_id, text=None, photo_id=None):
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private', 'first_name': f'User{user_id}'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'},
+    }
+    if photo_id:
+        message['photo'] = [{'file_id': photo_id, 'file_unique_id': photo_id[-16:], 'width': 1080, 'height': 1920, 'file_size': 51200}]
+    else:
+        message['text'] = text
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+def callback_update(update_id, user_id, data):
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'chat_instance': 'bench',
+            'data': data,
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Admin'},
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': 1, 'is_bot': True, 'first_name': 'Bench'},
+                'text': "Approve or reject this payment:"
+            }
+        }
+    }
+
+async def drive(application, updates, concurrency):
+    # Feed updates the way the webhook does and time each one through its handler
+    from telegram import Update
+    latencies = []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(data):
+        async with slots:
+            update = Update.de_json(data, application.bot)
+            started = time.perf_counter()
+            await application.update_processor.process_update(update, application.process_update(update))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(asyncio.create_task(one(data)) for data in updates))
+    elapsed = time.perf_counter() - started
+    return {
+        'updates': len(updates),
+        'elapsed': round(elapsed, 3),
+        'throughput': round(len(updates) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+class UpdateIds:
+    def __init__(self):
+        self.last = 0
+
+    def next(self):
+        self.last += 1
+        return self.last
+
+async def scenario_start(application, args, ids):
+    # Every user twice: first visit creates the row, the second is a returning user
+    user_ids = [FIRST_USER_ID + i for i in range(args.users)] * 2
+    random.shuffle(user_ids)
+    return await drive(application, [message_update(ids.next(), uid, '/start') for uid in user_ids], args.concurrency)
+
+async def scenario_submit(application, args, ids):
+    updates = []
+    for i in range(args.users):
+        user_id = FIRST_USER_ID + i
+        updates.append(message_update(ids.next(), user_id, photo_id=f"proof-{user_id:012d}-AgACAgIAAxkBAAIB"))
+        updates.append(message_update(ids.next(), user_id, f"User Number {user_id}"))
+    return await drive(application, updates, args.concurrency)
+
+async def scenario_approve(application, args, ids):
+    updates = [callback_update(ids.next(), ADMIN_USER_ID, f"approve_{FIRST_USER_ID + i}") for i in range(args.users)]
+    return await drive(application, updates, args.concurrency)
+
+def seed_users(count, expired_fraction, chunk=10000):
+    # Approved users with expiries spread over the next 30 days; a few expired in the last hour
+    from sqlalchemy import insert
+    from database import db, User
+    now = datetime.now()
+    with db.engine.begin() as connection:
+        for start in range(0, count, chunk):
+            rows = []
+            for i in range(start, min(start + chunk, count)):
+                if random.random() < expired_fraction:
+                    subscription_end = now - timedelta(seconds=random.uniform(0, 3600))
+                else:
+                    subscription_end = now + timedelta(seconds=random.uniform(0, 30 * 86400))
+                rows.append({
+                    'user_id': 10000000 + i,
+                    'username': f'seed{i}',
+                    'full_name': f'Seed User {i}',
+                    'is_approved': True,
+                    'is_banned': False,
+                    'subscription_end': subscription_end,
+                    'created_at': now - timedelta(days=30)
+                })
+            connection.execute(insert(User), rows)
+
+async def scenario_sweep(application, args, ids):
+    from user_management import check_subscriptions
+    started = time.perf_counter()
+    await asyncio.to_thread(seed_users, args.sweep_users, args.expired_fraction)
+    seeded = time.perf_counter() - started
+
+    started = time.perf_counter()
+    expired = await check_subscriptions(application.bot)
+    first = time.perf_counter() - started
+
+    # What the next hourly run costs when nothing new is due
+    started = time.perf_counter()
+    await check_subscriptions(application.bot)
+    repeat = time.perf_counter() - started
+
+    return {
+        'users': args.sweep_users,
+        'seed_s': round(seeded, 3),
+        'elapsed': round(first, 3),
+        'expired': len(expired),
+        'users_per_s': round(args.sweep_users / first, 1) if first else 0.0,
+        'repeat_s': round(repeat, 3),
+    }
+
+async def run_suite(args):
+    from bot import build_application
+    from migrations import migrate
+    migrate()
+    application = build_application(background_jobs=False)
+    ids = UpdateIds()
+    results = {}
+    async with application:
+        await application.post_init(application)
+        await application.start()
+        for name in args.scenarios:
+            with quiet_stdout(not args.verbose):
+                result = await globals()[f"scenario_{name}"](application, args, ids)
+            result['peak_rss_mb'] = round(peak_rss_mb(), 1)
+            results[name] = result
+            print(f"{name:8} {json.dumps(result)}", flush=True)
+        await application.stop()
+        await application.post_shutdown(application)
+    return results
+
+# Higher is better for these; lower for everything else compared
+HIGHER_IS_BETTER = ('throughput', 'users_per_s')
+COMPARED = ('throughput', 'p50_ms', 'p99_ms', 'elapsed', 'users_per_s', 'repeat_s', 'peak_rss_mb')
+
+def compare(results, baseline):
+    print(f"\nCompared with {baseline['meta']['saved_at']}:")
+    for name, result in results.items():
+        before = baseline['results'].get(name)
+        if not before:
+            continue
+        changes = []
+        for metric in COMPARED:
+            if metric in result and before.get(metric):
+                change = (result[metric] - before[metric]) / before[metric] * 100
+                better = change > 0 if metric in HIGHER_IS_BETTER else change < 0
+                changes.append(f"{metric} {before[metric]} -> {result[metric]} ({change:+.1f}%{'' if abs(change) < 5 else ' ✓' if better else ' ✗'})")
+        print(f"{name:8} " + ", ".join(changes))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bot's handlers against a local stand-in Bot API")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"comma-separated, from {','.join(SCENARIOS)}")
+    parser.add_argument('--users', type=int, default=1000, help="users in the start/submit/approve scenarios")
+    parser.add_argument('--concurrency', type=int, default=100, help="updates in flight at once")
+    parser.add_argument('--sweep-users', type=int, default=100000)
+    parser.add_argument('--expired-fraction', type=float, default=0.002, help="seeded users expired in the last hour")
+    parser.add_argument('--latency', type=float, default=0.0, help="stand-in API latency per call, seconds")
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--flood-rate', type=float, default=0.0, help="fraction of API calls answered with 429")
+    parser.add_argument('--rate-limited', action='store_true', help="keep the outbound rate limiter on")
+    parser.add_argument('--save', help="write the results to this JSON file as a baseline")
+    parser.add_argument('--compare', help="baseline JSON to compare against")
+    parser.add_argument('--verbose', action='store_true', help="keep the bot's own output")
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    port = free_port()
+    workdir = bench_env(port, args.rate_limited)
+    import logging
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    from benchmarks.fake_bot_api import serve
+
+    api = multiprocessing.get_context('spawn').Process(
+        target=serve, args=('127.0.0.1', port, args.latency, args.jitter, args.flood_rate), daemon=True
+    )
+    api.start()
+    time.sleep(1)
+    print(f"Benchmark data in {workdir}")
+
+    try:
+        results = asyncio.run(run_suite(args))
+    finally:
+        api.terminate()
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    if args.save:
+        meta = {
+            'saved_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'args': {k: v for k, v in vars(args).items() if k not in ('save', 'compare', 'verbose')},
+        }
+        with open(args.save, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+        print(f"Baseline saved to {args.save}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# POST recorded (or synthetic) update JSON to a running webhook and report throughput.
+#
+#   WEBHOOK_SECRET=local RUN_MODE=webhook python bot.py
+#   python -m benchmarks.webhook_harness --secret local --file benchmarks/sample_updates.jsonl --repeat 1000
+import argparse
+import asyncio
+import copy
+import json
+import time
+import aiohttp
+from benchmarks.common import percentile
+
+def load_updates(path):
+    with open(path) as f:
+        if path.endswith('.jsonl'):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+def synthetic_start(update_id, user_id):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': f'User{user_id}'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'},
+            'text': '/start',
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}]
+        }
+    }
+
+def expand(updates, repeat, users):
+    # Replay the recording `repeat` times with fresh update_ids, spreading it over `users` ids
+    expanded = []
+    update_id = 1
+    for round_number in range(repeat):
+        user_offset = (round_number % users) * 1000000
+        for update in updates:
+            update = copy.deepcopy(update)
+            update['update_id'] = update_id
+            for key in ('message', 'edited_message', 'callback_query'):
+                if key in update:
+                    update[key]['from']['id'] += user_offset
+                    if 'chat' in update[key]:
+                        update[key]['chat']['id'] += user_offset
+            expanded.append(update)
+            update_id += 1
+    return expanded
+
+async def run(url, secret, updates, concurrency):
+    latencies = []
+    statuses = {}
+    queue = asyncio.Queue()
+    for update in updates:
+        queue.put_nowait(update)
+
+    async def worker(session):
+        while not queue.empty():
+            update = queue.get_nowait()
+            started = time.perf_counter()
+            try:
+                async with session.post(url, json=update, headers={'X-Telegram-Bot-Api-Secret-Token': secret}) as response:
+                    status = response.status
+            except aiohttp.ClientError:
+                status = 'error'
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        'updates': len(updates),
+        'elapsed': elapsed,
+        'throughput': len(updates) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'statuses': statuses,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay update JSON against a local webhook")
+    parser.add_argument('--url', default='http://127.0.0.1:8443/telegram')
+    parser.add_argument('--secret', required=True, help="WEBHOOK_SECRET the bot was started with")
+    parser.add_argument('--file', help="JSON list or JSONL of recorded updates; synthetic /start updates if omitted")
+    parser.add_argument('--count', type=int, default=1000, help="synthetic updates to send when no file is given")
+    parser.add_argument('--repeat', type=int, default=1, help="times to replay the recorded file")
+    parser.add_argument('--users', type=int, default=100, help="distinct users to spread replays over")
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+
+    if args.file:
+        updates = expand(load_updates(args.file), args.repeat, args.users)
+    else:
+        updates = [synthetic_start(i + 1, 1000 + i % args.users) for i in range(args.count)]
+
+    result = asyncio.run(run(args.url, args.secret, updates, args.concurrency))
+    print(f"Sent {result['updates']} updates in {result['elapsed']:.2f}s "
+          f"({result['throughput']:.0f}/s), p50 {result['p50_ms']:.1f}ms, p99 {result['p99_ms']:.1f}ms")
+    print(f"Responses: {result['statuses']}")
+
+if __name__ == '__main__':
+    main()
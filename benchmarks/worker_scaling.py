@@ -0,0 +1,58 @@
+# Throughput of RUN_MODE=workers against a stand-in feed and Bot API, for several worker counts.
+#
+#   python -m benchmarks.worker_scaling --workers 1,2,4 --updates 5000
+import argparse
+import asyncio
+import multiprocessing
+import os
+import time
+from benchmarks.common import free_port, bench_env, quiet_stdout
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure update throughput for several worker counts")
+    parser.add_argument('--workers', default='1,2,4', help="comma-separated worker counts")
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--api-processes', type=int, default=os.cpu_count() or 1,
+                        help="stand-in API server processes, so the API isn't the bottleneck")
+    parser.add_argument('--verbose', action='store_true', help="keep the bot's own output")
+    args = parser.parse_args()
+
+    port = free_port()
+    workdir = bench_env(port)
+    from benchmarks.fake_bot_api import serve
+    from benchmarks.webhook_harness import synthetic_start
+    from workers import run_workers
+    from database import Database
+    from migrations import migrate
+
+    context = multiprocessing.get_context('spawn')
+    api = [context.Process(target=serve, args=('127.0.0.1', port), daemon=True) for _ in range(args.api_processes)]
+    for process in api:
+        process.start()
+    time.sleep(1)
+
+    results = []
+    for count in [int(n) for n in args.workers.split(',')]:
+        # Fresh database per run so every run sees the same mix of new and known users
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, f'bench-{count}.db')}"
+        engine = Database(os.environ['DATABASE_URL']).engine
+        with quiet_stdout(not args.verbose):
+            migrate(engine)
+        engine.dispose()
+        updates = [synthetic_start(i + 1, 1000 + i % args.users) for i in range(args.updates)]
+        with quiet_stdout(not args.verbose):
+            elapsed = asyncio.run(run_workers(count, updates))
+        results.append((count, elapsed))
+        print(f"{count} worker(s): {args.updates} updates in {elapsed:.2f}s ({args.updates / elapsed:.0f}/s)", flush=True)
+
+    first_count, first_elapsed = results[0]
+    for count, elapsed in results[1:]:
+        print(f"{count} worker(s): {first_elapsed / elapsed:.2f}x the throughput of {first_count} "
+              f"(linear would be {count / first_count:.1f}x)")
+
+    for process in api:
+        process.terminate()
+
+if __name__ == '__main__':
+    main()
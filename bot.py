@@ -1,9 +1,30 @@
-import os
+import time
+# Import-to-ready time is measured from here
+STARTED = time.perf_counter()
+
+import asyncio
+import html
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
-from config import BOT_TOKEN, ADMIN_ID, CHANNEL_ID, WELCOME_MESSAGE, PHONE_NUMBER, WELCOME_VIDEO_URL
-from database import db
+from config import BOT_TOKEN, ADMIN_ID, CHANNEL_ID, WELCOME_MESSAGE, PHONE_NUMBER, WELCOME_VIDEO_URL, STORE_PAYMENT_PROOFS, RUN_MODE, WORKER_COUNT, BOT_API_URL, RATE_LIMITER_ENABLED, FLOOD_CONTROL_ENABLED
+from database import async_db
+from rate_limiter import rate_limiter
+from user_cache import user_cache
+from admin import show_pending_approvals, pending_page_callback
+from proof_storage import proof_storage, store_user_proof
+from media_cache import media_cache
+from duplicates import duplicate_detector, describe
+from flood_control import flood_control
+from review_queue import review_queue, send_for_review
+from outbox import outbox_delivery, notify, invite
+from exports import export_users
+from webhook_server import run_webhook
+from persistence import SQLPersistence
+from metrics import registry, CallbackGauge, timed_handler, InstrumentedRequest, metrics_server
+from migrations import migrate
+from workers import PerUserUpdateProcessor, run_workers
+from user_management import expiry_timers, start_scheduler, stop_scheduler
 from datetime import datetime, timedelta
 
 # Setup logging
@@ -12,33 +33,55 @@ logging.basicConfig(
     level=logging.INFO
 )
 
-# Check essential variables
-if not BOT_TOKEN or not ADMIN_ID or not CHANNEL_ID:
-    print("❌ ERROR: Missing essential environment variables!")
-    print(f"BOT_TOKEN: {'Set' if BOT_TOKEN else 'Missing'}")
-    print(f"ADMIN_ID: {'Set' if ADMIN_ID else 'Missing'}")
-    print(f"CHANNEL_ID: {'Set' if CHANNEL_ID else 'Missing'}")
-    exit(1)
+# Seconds spent importing, migrating and until the application is ready
+startup = {'imports': time.perf_counter() - STARTED}
+registry.register(CallbackGauge(
+    'bot_startup_seconds', "Seconds from import to ready", lambda: startup['ready']))
+
+def check_env():
+    # Check essential variables
+    if not BOT_TOKEN or not ADMIN_ID or not CHANNEL_ID:
+        print("❌ ERROR: Missing essential environment variables!")
+        print(f"BOT_TOKEN: {'Set' if BOT_TOKEN else 'Missing'}")
+        print(f"ADMIN_ID: {'Set' if ADMIN_ID else 'Missing'}")
+        print(f"CHANNEL_ID: {'Set' if CHANNEL_ID else 'Missing'}")
+        exit(1)
+    print("✅ Environment variables loaded successfully")
+
+def init():
+    # Everything that touches the outside world before serving; nothing runs on import
+    check_env()
+    started = time.perf_counter()
+    migrate()
+    startup['migrations'] = time.perf_counter() - started
+
+# Telegram's limit on media captions
+CAPTION_LIMIT = 1024
 
-print("✅ Environment variables loaded successfully")
+def render_welcome():
+    return "\n\n".join([
+        html.escape(WELCOME_MESSAGE.format(PHONE_NUMBER).strip()),
+        f"📞 Phone: <code>{html.escape(PHONE_NUMBER)}</code>",
+        "💳 Send a screenshot of your payment to begin verification."
+    ])
 
-UPLOADS_DIR = "uploads"
-os.makedirs(UPLOADS_DIR, exist_ok=True)
+WELCOME_TEXT = render_welcome()
 
+@timed_handler('start')
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user = update.effective_user
         print(f"User {user.id} started the bot")
         
         # Check if user is banned
-        db_user = db.get_user(user.id)
+        db_user = await async_db.get_user_status(user.id)
         if db_user and db_user.is_banned:
             await update.message.reply_text("❌ Your account is banned. Make a new payment to regain access.")
             return
         
         # Create user if not exists
         if not db_user:
-            db.add_user({
+            await async_db.add_user({
                 'user_id': user.id,
                 'username': user.username or '',
                 'full_name': user.full_name or '',
@@ -46,39 +89,43 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 'is_banned': False
             })
         
-        # Send welcome video
+        # The whole welcome as the video's caption: one call, or one text message without the video
         try:
-            await update.message.reply_video(
-                video=WELCOME_VIDEO_URL,
-                caption="🎥 Welcome to our premium service!"
+            sent = await media_cache.send_video(
+                context.bot, update.effective_chat.id, WELCOME_VIDEO_URL,
+                caption=WELCOME_TEXT if len(WELCOME_TEXT) <= CAPTION_LIMIT else None,
+                parse_mode='HTML'
             )
         except Exception as e:
             print(f"Video error: {e}")
-            await update.message.reply_text("🎉 Welcome to our premium service!")
-        
-        # Send welcome message
-        await update.message.reply_text(WELCOME_MESSAGE.format(PHONE_NUMBER))
-        await update.message.reply_text(f"📞 Phone: `{PHONE_NUMBER}`", parse_mode='Markdown')
-        await update.message.reply_text("💳 Send a screenshot of your payment to begin verification.")
+            sent = None
+        if not sent or len(WELCOME_TEXT) > CAPTION_LIMIT:
+            await update.message.reply_text(WELCOME_TEXT, parse_mode='HTML')
         
     except Exception as e:
         print(f"Start error: {e}")
         await update.message.reply_text("Sorry, something went wrong. Please try again.")
 
+@timed_handler('handle_payment')
 async def handle_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user = update.effective_user
         
         if update.message.photo:
-            # Save payment screenshot
+            # Keep Telegram's ids so the admin gets the same photo without a re-upload
             photo = update.message.photo[-1]
-            file = await photo.get_file()
-            filename = f"{user.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-            file_path = os.path.join(UPLOADS_DIR, filename)
-            await file.download_to_drive(file_path)
+            context.user_data['proof_file_id'] = photo.file_id
+            context.user_data['proof_file_unique_id'] = photo.file_unique_id
+            context.user_data['proof_path'] = ''
+            
+            # Save payment screenshot locally without holding up the reply
+            if STORE_PAYMENT_PROOFS:
+                context.application.create_task(
+                    store_user_proof(photo, user.id, context.user_data, 'proof_path'),
+                    update=update
+                )
             
-            # Store file path and ask for name
-            context.user_data['proof_path'] = file_path
+            # Ask for name
             await update.message.reply_text("📝 Please type your full name exactly as on the receipt:")
             context.user_data['awaiting_name'] = True
         else:
@@ -88,124 +135,93 @@ async def handle_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
         print(f"Payment error: {e}")
         await update.message.reply_text("Error processing payment. Please try again.")
 
+@timed_handler('handle_name')
 async def handle_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user = update.effective_user
         full_name = update.message.text
         proof_path = context.user_data.get('proof_path', '')
+        proof_file_id = context.user_data.get('proof_file_id')
+        
+        # Hand the submission to the next reviewer, leased to them until it's decided
+        reviewer_id = review_queue.next_reviewer()
+        submission = {
+            'full_name': full_name,
+            'payment_proof_path': proof_path,
+            'proof_file_id': proof_file_id,
+            **review_queue.claim(reviewer_id)
+        }
         
         # Update user in database
-        db_user = db.get_user(user.id)
+        db_user = await async_db.get_user_status(user.id)
         if db_user:
-            db.update_user(user.id, {
-                'full_name': full_name,
-                'payment_proof_path': proof_path
-            })
+            # A new submission puts the user back in the review queue
+            await async_db.update_user(user.id, {**submission, 'is_banned': False})
         else:
-            db.add_user({
+            await async_db.add_user({
                 'user_id': user.id,
                 'username': user.username or '',
-                'full_name': full_name,
-                'payment_proof_path': proof_path,
                 'is_approved': False,
-                'is_banned': False
+                'is_banned': False,
+                **submission
             })
         
-        # Send screenshot to admin
-        try:
-            with open(proof_path, 'rb') as photo:
-                await context.bot.send_photo(
-                    chat_id=ADMIN_ID,
-                    photo=photo,
-                    caption=f"🆕 Payment from: @{user.username or 'No username'}\nName: {full_name}\nID: {user.id}"
-                )
-        except:
-            await context.bot.send_message(
-                chat_id=ADMIN_ID,
-                text=f"🆕 Payment from: @{user.username or 'No username'}\nName: {full_name}\nID: {user.id}"
-            )
-        
-        # Send approval buttons to admin
-        keyboard = [[
-            InlineKeyboardButton("✅ Approve", callback_data=f"approve_{user.id}"),
-            InlineKeyboardButton("❌ Reject", callback_data=f"reject_{user.id}")
-        ]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        # The background download may have finished while we were saving
+        if context.user_data.get('proof_path', '') != proof_path:
+            await async_db.update_user(user.id, {'payment_proof_path': context.user_data['proof_path']})
         
-        await context.bot.send_message(
-            chat_id=ADMIN_ID,
-            text="Approve or reject this payment:",
-            reply_markup=reply_markup
-        )
+        # Send screenshot to the reviewer, flagged if it looks like another user's proof
+        matches = await duplicate_detector.matches_for(user.id)
+        caption = f"🆕 Payment from: @{user.username or 'No username'}\nName: {full_name}\nID: {user.id}{describe(matches)}"
+        await send_for_review(context.bot, reviewer_id, user.id, caption, proof_file_id)
         
         await update.message.reply_text("✅ Payment received! Waiting for admin approval.")
         context.user_data['awaiting_name'] = False
+        flood_control.proof_submitted(user.id)
         
     except Exception as e:
         print(f"Name error: {e}")
         await update.message.reply_text("Error processing your information. Please try again.")
 
+@timed_handler('handle_callback')
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         query = update.callback_query
         await query.answer()
         
-        # Verify admin
-        if query.from_user.id != ADMIN_ID:
+        # Verify reviewer
+        if not review_queue.is_reviewer(query.from_user.id):
             await query.message.reply_text("❌ Only admin can do this.")
             return
         
         action, user_id = query.data.split('_')
         user_id = int(user_id)
-        target_user = db.get_user(user_id)
         
+        if action == 'approve':
+            # Set 30-day subscription
+            subscription_end = datetime.now() + timedelta(days=30)
+            values = {'is_approved': True, 'is_banned': False, 'subscription_end': subscription_end}
+            notices = [invite(user_id, f"🎉 Payment approved! You have 30 days access.\nExpires: {subscription_end.strftime('%Y-%m-%d')}", 'approved')]
+        elif action == 'reject':
+            values = {'is_approved': False, 'is_banned': True}
+            notices = [notify(user_id, "❌ Payment rejected. Please check details and try again.", 'rejected')]
+        else:
+            return
+        
+        # A conditional UPDATE decides: a second tap, or a button from a submission
+        # that has since gone to another reviewer, stops here before any side effects.
+        # The user's notice and channel invite commit with it and go out from the outbox.
+        target_user = await async_db.decide_claimed(user_id, query.from_user.id, values, outbox=notices)
         if not target_user:
-            await query.edit_message_text("❌ User not found.")
+            await query.edit_message_text("⚠️ Already handled, or now with another reviewer.")
             return
+        outbox_delivery.wake()
         
         if action == 'approve':
-            # Set 30-day subscription
-            subscription_end = datetime.now() + timedelta(days=30)
-            db.update_user(user_id, {
-                'is_approved': True,
-                'is_banned': False,
-                'subscription_end': subscription_end
-            })
-            
-            # Add to channel
-            try:
-                await context.bot.add_chat_member(
-                    chat_id=CHANNEL_ID,
-                    user_id=user_id
-                )
-                channel_info = "✅ Added to private channel"
-            except Exception as e:
-                print(f"Channel error: {e}")
-                channel_info = "⚠️ Could not add to channel automatically"
-            
-            # Notify user
-            try:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=f"🎉 Payment approved! You have 30 days access.\n{channel_info}\nExpires: {subscription_end.strftime('%Y-%m-%d')}"
-                )
-            except:
-                pass
-            
+            expiry_timers.arm(user_id, subscription_end)
             await query.edit_message_text(f"✅ Approved user @{target_user.username}")
-            
-        elif action == 'reject':
-            db.update_user(user_id, {'is_approved': False, 'is_banned': True})
-            
-            # Notify user
-            try:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text="❌ Payment rejected. Please check details and try again."
-                )
-            except:
-                pass
-            
+        else:
+            expiry_timers.disarm(user_id)
             await query.edit_message_text(f"❌ Rejected user @{target_user.username}")
             
     except Exception as e:
@@ -226,32 +242,121 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if update.effective_user.id != ADMIN_ID:
             return
         
-        users = db.get_all_users()
-        active = len([u for u in users if u.is_subscription_active()])
-        pending = len([u for u in users if not u.is_approved and not u.is_banned])
+        counts = await async_db.get_stats()
+        if not counts:
+            await update.message.reply_text("Could not load statistics.")
+            return
+        
+        expiries = "\n".join(f"  {day}: {count}" for day, count in counts['expiries_per_day']) or "  none"
+        limits = rate_limiter.get_stats()
+        cache = user_cache.get_stats()
+        flood = flood_control.get_stats()
+        queued = await async_db.get_outbox_stats()
+        delivered = outbox_delivery.get_stats()
+        dropped = ", ".join(f"{kind} {count}" for kind, count in sorted(flood['dropped_by_kind'].items())) or "none"
         
-        stats = f"📊 Stats:\nUsers: {len(users)}\nActive: {active}\nPending: {pending}"
+        stats = (
+            f"📊 Stats:\nUsers: {counts['total']}\nActive: {counts['active']}\n"
+            f"Pending: {counts['pending']}\nBanned: {counts['banned']}\n"
+            f"🧑‍⚖️ With reviewers: {counts['claimed']} ({counts['overdue']} past their lease), "
+            f"{review_queue.reassigned} reassigned, {len(review_queue.reviewers)} reviewer(s)\n\n"
+            f"⏳ Expiring in the next 7 days:\n{expiries}\n\n"
+            f"📤 Outbound queue: {limits['queue_depth']} waiting (peak {limits['peak_queue_depth']})\n"
+            f"Delayed: {limits['delayed_requests']}/{limits['requests']}, "
+            f"avg wait {limits['avg_wait']:.2f}s, max wait {limits['max_wait']:.2f}s\n"
+            f"Flood limit hits: {limits['retry_after_hits']}\n"
+            f"🗂 User cache: {cache['hits']} hits / {cache['misses']} misses ({cache['hit_rate']:.0%})\n"
+            f"🚧 Flood control: {flood['dropped']} dropped ({dropped}), "
+            f"{flood['debounced_proofs']} repeat proofs, {flood['tracked']} active senders\n"
+            f"📬 Outbox: {queued['pending']} pending, {queued['dead']} dead-lettered "
+            f"({delivered['sent']} sent, {delivered['retried']} retried here)"
+        )
         await update.message.reply_text(stats)
     except Exception as e:
         print(f"Stats error: {e}")
 
+async def load_settings(application):
+    # Set after persistence has loaded bot_data so config always wins
+    application.bot_data['admin_id'] = ADMIN_ID
+    application.bot_data['channel_id'] = CHANNEL_ID
+    await metrics_server.start()
+    if 'ready' not in startup:
+        startup['ready'] = time.perf_counter() - STARTED
+        print(f"🚀 Ready in {startup['ready']:.2f}s (imports {startup['imports']:.2f}s, "
+              f"migrations {startup.get('migrations', 0):.2f}s)")
+
+async def on_startup(application):
+    await load_settings(application)
+    await start_scheduler(application)
+    proof_storage.start_compaction()
+    review_queue.start(application.bot)
+    outbox_delivery.start(application.bot)
+
+async def on_stop(application):
+    # Jobs that call Telegram stop here, while the bot can still send: the shutdown
+    # that follows closes its HTTP client
+    await stop_scheduler(application)
+    await review_queue.stop()
+    await outbox_delivery.stop()
+
+async def on_shutdown(application):
+    await proof_storage.stop()
+    duplicate_detector.stop()
+    await metrics_server.stop()
+
+def build_application(background_jobs=True):
+    # background_jobs=False for worker processes other than the one running the timers
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        # Times every Bot API call for /metrics
+        .request(InstrumentedRequest(connection_pool_size=256))
+        # Concurrent across users, in order for each user
+        .concurrent_updates(PerUserUpdateProcessor())
+        .persistence(SQLPersistence())
+        # Nothing uses PTB's JobQueue; skips starting APScheduler
+        .job_queue(None)
+        .post_init(on_startup if background_jobs else load_settings)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+    )
+    if RATE_LIMITER_ENABLED:
+        builder.rate_limiter(rate_limiter)
+    if BOT_API_URL:
+        builder.base_url(f"{BOT_API_URL.rstrip('/')}/bot").base_file_url(f"{BOT_API_URL.rstrip('/')}/file/bot")
+    application = builder.build()
+    
+    # Throttling runs before every other handler
+    if FLOOD_CONTROL_ENABLED:
+        application.add_handler(flood_control.handler(), group=-1)
+    
+    # Add handlers
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("stats", admin_stats))
+    application.add_handler(CommandHandler("approvals", show_pending_approvals))
+    application.add_handler(CommandHandler("export", export_users))
+    application.add_handler(CallbackQueryHandler(pending_page_callback, pattern=r'^pending:'))
+    application.add_handler(CallbackQueryHandler(handle_callback))
+    application.add_handler(MessageHandler(filters.PHOTO, handle_payment))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    return application
+
 def main():
     try:
-        application = Application.builder().token(BOT_TOKEN).build()
-        
-        # Add handlers
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("stats", admin_stats))
-        application.add_handler(CallbackQueryHandler(handle_callback))
-        application.add_handler(MessageHandler(filters.PHOTO, handle_payment))
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-        
         print("✅ Bot starting...")
         print(f"🤖 Bot Token: {'✓' if BOT_TOKEN else '✗'}")
         print(f"👑 Admin ID: {ADMIN_ID}")
+        print(f"🧑‍⚖️ Reviewers: {', '.join(map(str, review_queue.reviewers))}")
         print(f"📢 Channel ID: {CHANNEL_ID}")
+        print(f"🔌 Mode: {RUN_MODE}")
+        init()
         
-        application.run_polling()
+        if RUN_MODE == 'workers':
+            asyncio.run(run_workers(WORKER_COUNT))
+        elif RUN_MODE == 'webhook':
+            asyncio.run(run_webhook(build_application()))
+        else:
+            build_application().run_polling()
         
     except Exception as e:
         print(f"❌ Fatal error: {e}")
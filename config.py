@@ -14,7 +14,108 @@ try:
 except (ValueError, TypeError):
     ADMIN_ID = 0
 
+# Reviewers sharing the approval queue, comma-separated ids. ADMIN_ID is always one
+# of them and stays the only one for /stats, /approvals and /export.
+try:
+    ADMIN_IDS = [int(part) for part in os.getenv('ADMIN_IDS', '').split(',') if part.strip()]
+except ValueError:
+    ADMIN_IDS = []
+if not ADMIN_ID and ADMIN_IDS:
+    ADMIN_ID = ADMIN_IDS[0]
+if ADMIN_ID and ADMIN_ID not in ADMIN_IDS:
+    ADMIN_IDS.insert(0, ADMIN_ID)
+# A reviewer holds a submission this long before it's handed to the next one
+REVIEW_LEASE_SECONDS = int(os.getenv('REVIEW_LEASE_SECONDS', '900'))
+
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///bot_database.db')
+# Connections kept open per engine, plus how many more may be opened under load
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', '30'))
+# Seconds before a server-side connection is replaced (ignored for SQLite)
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+SQLITE_WAL = os.getenv('SQLITE_WAL', 'true').lower() in ('1', 'true', 'yes')
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+
+# Seconds between persistence rounds for user/chat/bot data
+PERSISTENCE_INTERVAL = float(os.getenv('PERSISTENCE_INTERVAL', '5'))
+
+# "polling", "webhook" or "workers" (polling, with updates spread over WORKER_COUNT processes)
+RUN_MODE = os.getenv('RUN_MODE', 'polling').strip().lower()
+WORKER_COUNT = int(os.getenv('WORKER_COUNT', '0')) or os.cpu_count() or 1
+# Updates each worker process runs at once; beyond that the dispatcher waits
+WORKER_MAX_PENDING = int(os.getenv('WORKER_MAX_PENDING', '256'))
+# Alternative Bot API server, e.g. a local one or a stand-in for load tests
+BOT_API_URL = os.getenv('BOT_API_URL', '').strip()
+# Pace outbound calls to Telegram's flood limits; only turn off against a stand-in API
+RATE_LIMITER_ENABLED = os.getenv('RATE_LIMITER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+# Inbound flood control: per user, updates of each kind allowed per minute (also the burst size)
+FLOOD_CONTROL_ENABLED = os.getenv('FLOOD_CONTROL_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+FLOOD_LIMITS = {
+    'photo': int(os.getenv('FLOOD_PHOTOS_PER_MINUTE', '3')),
+    'text': int(os.getenv('FLOOD_MESSAGES_PER_MINUTE', '20')),
+    'command': int(os.getenv('FLOOD_COMMANDS_PER_MINUTE', '10')),
+    'callback': int(os.getenv('FLOOD_CALLBACKS_PER_MINUTE', '60')),
+}
+# Further proofs from a user whose submission is awaiting review are dropped for this long
+PROOF_DEBOUNCE_SECONDS = int(os.getenv('PROOF_DEBOUNCE_SECONDS', '600'))
+
+# Public base URL Telegram should post to, e.g. https://bot.example.com
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').strip()
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+# Shared by every instance behind a load balancer; random per process if unset
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '').strip()
+# Updates in flight before the webhook answers 503 and lets Telegram retry
+WEBHOOK_MAX_PENDING = int(os.getenv('WEBHOOK_MAX_PENDING', '1000'))
+
+# Users loaded per query by the subscription sweep
+SWEEP_BATCH_SIZE = int(os.getenv('SWEEP_BATCH_SIZE', '500'))
+# Telegram calls in flight at once while processing a batch
+SWEEP_CONCURRENCY = int(os.getenv('SWEEP_CONCURRENCY', '20'))
+# Days before expiry at which reminders go out, e.g. "7,3,1"
+REMINDER_DAYS = sorted(int(days) for days in os.getenv('REMINDER_DAYS', '1').split(',') if days.strip())
+# How far ahead expiry timers are held in memory; later ones are loaded as time moves on
+TIMER_HORIZON_HOURS = int(os.getenv('TIMER_HORIZON_HOURS', '48'))
+
+# Payment screenshots: content-addressed store, packed into archives after the retention window
+PROOF_STORAGE_DIR = os.getenv('PROOF_STORAGE_DIR', 'uploads')
+PROOF_RETENTION_DAYS = int(os.getenv('PROOF_RETENTION_DAYS', '90'))
+# Keep a local copy of each proof (downloaded in the background); the admin always gets the Telegram file_id
+STORE_PAYMENT_PROOFS = os.getenv('STORE_PAYMENT_PROOFS', 'true').lower() in ('1', 'true', 'yes')
+# Flag proofs that look like one another user already sent (needs Pillow and stored proofs)
+DUPLICATE_CHECK_ENABLED = os.getenv('DUPLICATE_CHECK_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Bits out of 64 two perceptual hashes may differ by and still count as the same receipt
+DUPLICATE_MAX_DISTANCE = int(os.getenv('DUPLICATE_MAX_DISTANCE', '6'))
+# Processes decoding and hashing images
+HASH_WORKERS = int(os.getenv('HASH_WORKERS', '1'))
+
+# Pending submissions shown per /approvals page
+PENDING_PAGE_SIZE = int(os.getenv('PENDING_PAGE_SIZE', '10'))
+
+# Background delivery of queued notifications and channel adds (see outbox.py)
+OUTBOX_CONCURRENCY = int(os.getenv('OUTBOX_CONCURRENCY', '20'))
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '100'))
+# Attempts before a message is dead-lettered
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8'))
+# Delivered messages are deleted after this long; dead letters are kept
+OUTBOX_RETENTION_DAYS = int(os.getenv('OUTBOX_RETENTION_DAYS', '7'))
+
+# Prometheus-format /metrics endpoint (worker processes use METRICS_PORT + their index)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))
+# Log one line per update with the DB and API calls it made; only updates slower than TRACE_MIN_MS
+TRACE_UPDATES = os.getenv('TRACE_UPDATES', 'false').lower() in ('1', 'true', 'yes')
+TRACE_MIN_MS = float(os.getenv('TRACE_MIN_MS', '0'))
+
+# In-process cache of user status (banned/approved/expiry) in front of the database
+USER_CACHE_ENABLED = os.getenv('USER_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', '300'))
 
 WELCOME_MESSAGE = """
 🎉 Welcome to Our Premium Service!
@@ -29,4 +130,5 @@ WELCOME_MESSAGE = """
 """
 
 PHONE_NUMBER = "+1234567890"  # Your phone number here
-WELCOME_VIDEO_URL = "https://www.youtube.com/watch?v=nF0rqeymxmQ&pp=ugUEEgJlbg%3D%3D"  # Your YouTube video URL
\ No newline at end of file
+# Direct video URL or local file; uploaded once, then resent by file_id
+WELCOME_VIDEO_URL = os.getenv('WELCOME_VIDEO_URL', "https://www.youtube.com/watch?v=nF0rqeymxmQ&pp=ugUEEgJlbg%3D%3D")
\ No newline at end of file
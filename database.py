@@ -1,8 +1,15 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean
+import threading
+from sqlalchemy import create_engine, event, select, insert, update, delete, exists, func, case, and_, or_, Column, Index, Integer, BigInteger, String, DateTime, Boolean, LargeBinary, UniqueConstraint
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from datetime import datetime, timedelta
-from config import DATABASE_URL
+from config import DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, SQLITE_WAL, SQLITE_BUSY_TIMEOUT_MS, SQLITE_SYNCHRONOUS
+from user_cache import user_cache, status_of, UserStatus
+from metrics import instrument_database
 
 Base = declarative_base()
 
@@ -13,11 +20,22 @@ class User(Base):
     user_id = Column(Integer, unique=True)
     username = Column(String, default='')
     full_name = Column(String, default='')
-    subscription_end = Column(DateTime)
+    phone_number = Column(String, default='')
+    subscription_end = Column(DateTime, index=True)
     is_approved = Column(Boolean, default=False)
     is_banned = Column(Boolean, default=False)
     payment_proof_path = Column(String, default='')
     created_at = Column(DateTime, default=datetime.now)
+    # Submission under review: Telegram file_id of the proof, the reviewer holding it and until when
+    proof_file_id = Column(String)
+    claimed_by = Column(Integer)
+    claim_expires_at = Column(DateTime)
+    
+    __table_args__ = (
+        Index('ix_users_status', 'is_approved', 'is_banned'),
+        Index('ix_users_review_queue', 'is_approved', 'is_banned', 'created_at', 'id'),
+        Index('ix_users_claim_expires', 'claim_expires_at'),
+    )
     
     def is_subscription_active(self):
         if not self.is_approved or self.is_banned:
@@ -26,52 +44,927 @@ class User(Base):
             return False
         return self.subscription_end > datetime.now()
 
+# Persisted progress of the periodic sweeps, one row per sweep
+class SweepState(Base):
+    __tablename__ = 'sweep_state'
+    
+    name = Column(String, primary_key=True)
+    watermark = Column(DateTime)
+
+# Lifecycle notices already sent, one row per user, notice kind and subscription period
+class Notification(Base):
+    __tablename__ = 'notifications'
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    kind = Column(String, nullable=False)
+    period_end = Column(DateTime, nullable=False)
+    sent_at = Column(DateTime, default=datetime.now)
+    
+    __table_args__ = (
+        UniqueConstraint('user_id', 'kind', 'period_end', name='uq_notifications_user_kind_period'),
+    )
+
+# Payment proofs moved out of the loose store into a compressed archive
+class ArchivedProof(Base):
+    __tablename__ = 'archived_proofs'
+    
+    key = Column(String, primary_key=True)
+    archive = Column(String, nullable=False)
+    archived_at = Column(DateTime, default=datetime.now)
+
+# Pickled user/chat/bot data for the Application's persistence
+class ConversationState(Base):
+    __tablename__ = 'conversation_state'
+    
+    kind = Column(String, primary_key=True)
+    key = Column(BigInteger, primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+# Telegram file_ids of media the bot sends repeatedly, keyed by where it was uploaded from
+class MediaFile(Base):
+    __tablename__ = 'media_files'
+    
+    source = Column(String, primary_key=True)
+    file_id = Column(String, nullable=False)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+# Perceptual hash of each stored proof as four 16-bit chunks, each indexed for
+# multi-index near-duplicate lookups (see duplicates.py)
+class ProofHash(Base):
+    __tablename__ = 'proof_hashes'
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    proof_key = Column(String, nullable=False, index=True)
+    h0 = Column(Integer, nullable=False, index=True)
+    h1 = Column(Integer, nullable=False, index=True)
+    h2 = Column(Integer, nullable=False, index=True)
+    h3 = Column(Integer, nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.now)
+    
+    __table_args__ = (
+        UniqueConstraint('user_id', 'proof_key', name='uq_proof_hashes_user_proof'),
+    )
+
+# User-facing notices and channel adds, written in the same transaction as the state
+# change behind them and delivered in the background by outbox.OutboxDelivery
+class OutboxMessage(Base):
+    __tablename__ = 'outbox'
+    
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(BigInteger, nullable=False)
+    action = Column(String, nullable=False, default='message')
+    kind = Column(String, nullable=False, default='')
+    text = Column(String, default='')
+    status = Column(String, nullable=False, default='pending')
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.now)
+    last_error = Column(String)
+    created_at = Column(DateTime, default=datetime.now)
+    sent_at = Column(DateTime)
+    
+    __table_args__ = (
+        Index('ix_outbox_due', 'status', 'next_attempt_at'),
+    )
+
+def get_async_database_url(database_url):
+    # Swap the sync driver for its asyncio counterpart
+    url = make_url(database_url)
+    if url.drivername == 'sqlite':
+        url = url.set(drivername='sqlite+aiosqlite')
+    elif url.drivername in ('postgres', 'postgresql'):
+        url = url.set(drivername='postgresql+asyncpg')
+    return url
+
+def expiring_between_stmt(start, end, after=None, limit=500, unnotified=None):
+    # Approved users with start < subscription_end <= end, keyset-paginated on (subscription_end, id)
+    stmt = select(User).where(User.is_approved == True, User.subscription_end <= end)
+    if start is not None:
+        stmt = stmt.where(User.subscription_end > start)
+    if unnotified is not None:
+        # Skip users who already got this notice for the current period
+        stmt = stmt.where(~exists().where(
+            Notification.user_id == User.user_id,
+            Notification.kind == unnotified,
+            Notification.period_end == User.subscription_end
+        ))
+    if after is not None:
+        last_end, last_id = after
+        stmt = stmt.where(or_(
+            User.subscription_end > last_end,
+            and_(User.subscription_end == last_end, User.id > last_id)
+        ))
+    return stmt.order_by(User.subscription_end, User.id).limit(limit)
+
+# Columns written by /export, in file order
+EXPORT_COLUMNS = ('user_id', 'username', 'full_name', 'phone_number', 'is_approved', 'is_banned',
+                  'subscription_end', 'payment_proof_path', 'created_at')
+
+def export_users_stmt(status='all', date_field='created_at', start=None, end=None, now=None):
+    # Filters for /export, all applied in SQL: status is all/active/expired/pending/banned,
+    # start <= date_field < end
+    now = now or datetime.now()
+    stmt = select(*(getattr(User, name) for name in EXPORT_COLUMNS))
+    if status == 'active':
+        stmt = stmt.where(User.is_approved == True, User.is_banned == False, User.subscription_end > now)
+    elif status == 'expired':
+        stmt = stmt.where(User.is_approved == True, User.is_banned == False, User.subscription_end <= now)
+    elif status == 'pending':
+        stmt = stmt.where(User.is_approved == False, User.is_banned == False)
+    elif status == 'banned':
+        stmt = stmt.where(User.is_banned == True)
+    column = getattr(User, date_field)
+    if start is not None:
+        stmt = stmt.where(column >= start)
+    if end is not None:
+        stmt = stmt.where(column < end)
+    return stmt.order_by(User.id)
+
+def engine_options(database_url, is_async=False):
+    # Pool settings from config; in-memory SQLite keeps SQLAlchemy's single-connection pool
+    url = make_url(database_url)
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            return {}
+        options = {'pool_size': DB_POOL_SIZE, 'max_overflow': DB_MAX_OVERFLOW, 'pool_timeout': DB_POOL_TIMEOUT}
+        if is_async:
+            # aiosqlite defaults to NullPool: a new connection and thread for every session
+            options['poolclass'] = AsyncAdaptedQueuePool
+        return options
+    return {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': True,
+    }
+
+def tune_sqlite(engine):
+    # WAL lets readers run alongside the writer; busy_timeout makes writers queue
+    # instead of failing; synchronous=NORMAL is durable across crashes in WAL mode
+    if engine.dialect.name != 'sqlite':
+        return
+    
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if SQLITE_WAL:
+            cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+        cursor.execute(f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}')
+        cursor.close()
+
+# Sync access, kept for scripts and one-off maintenance: one short-lived session per call.
+# Nothing connects until first use; the schema is brought up to date by migrations.migrate().
+@instrument_database
 class Database:
-    def __init__(self):
-        self.engine = create_engine(DATABASE_URL)
-        Base.metadata.create_all(self.engine)
-        Session = sessionmaker(bind=self.engine)
-        self.session = Session()
+    def __init__(self, database_url=None):
+        self.database_url = database_url
+        self._engine = None
+        self._Session = None
+        self._lock = threading.Lock()
+    
+    def _connect(self):
+        with self._lock:
+            if self._engine is None:
+                url = self.database_url or DATABASE_URL
+                engine = create_engine(url, **engine_options(url))
+                tune_sqlite(engine)
+                # Returned objects stay readable after their session closes
+                self._Session = sessionmaker(bind=engine, expire_on_commit=False)
+                self._engine = engine
+    
+    @property
+    def engine(self):
+        if self._engine is None:
+            self._connect()
+        return self._engine
+    
+    @property
+    def Session(self):
+        if self._Session is None:
+            self._connect()
+        return self._Session
     
     def add_user(self, user_data):
         try:
-            user = User(**user_data)
-            self.session.add(user)
-            self.session.commit()
+            with self.Session() as session:
+                user = User(**user_data)
+                session.add(user)
+                session.commit()
+            user_cache.invalidate([user.user_id])
             return user
         except:
-            self.session.rollback()
             return None
     
     def get_user(self, user_id):
         try:
-            return self.session.query(User).filter_by(user_id=user_id).first()
+            with self.Session() as session:
+                return session.query(User).filter_by(user_id=user_id).first()
         except:
             return None
     
-    def update_user(self, user_id, update_data):
+    def update_user(self, user_id, update_data, outbox=None):
+        # outbox: notices to queue, committed together with the change
         try:
-            user = self.get_user(user_id)
-            if user:
+            with self.Session() as session:
+                user = session.query(User).filter_by(user_id=user_id).first()
+                if not user:
+                    return None
                 for key, value in update_data.items():
                     setattr(user, key, value)
-                self.session.commit()
-                return user
-            return None
+                session.add_all(OutboxMessage(**entry) for entry in outbox or [])
+                session.commit()
+            user_cache.invalidate([user_id])
+            return user
         except:
-            self.session.rollback()
             return None
     
+    def bulk_update_users(self, user_ids, update_data):
+        # One UPDATE and one commit for the whole set
+        try:
+            with self.Session() as session:
+                session.query(User).filter(User.user_id.in_(user_ids)).update(
+                    update_data, synchronize_session=False
+                )
+                session.commit()
+            user_cache.invalidate(user_ids)
+            return True
+        except:
+            return False
+    
     def get_all_users(self):
         try:
-            return self.session.query(User).all()
+            with self.Session() as session:
+                return session.query(User).all()
         except:
             return []
     
     def get_pending_approvals(self):
         try:
-            return self.session.query(User).filter_by(is_approved=False).all()
+            with self.Session() as session:
+                return session.query(User).filter_by(is_approved=False, is_banned=False).all()
+        except:
+            return []
+    
+    def iter_users_expiring_between(self, start, end, batch_size=500, unnotified=None):
+        # A session per batch, so nothing is held open while the caller works on one
+        after = None
+        while True:
+            with self.Session() as session:
+                batch = session.execute(
+                    expiring_between_stmt(start, end, after, batch_size, unnotified)
+                ).scalars().all()
+            if not batch:
+                return
+            yield batch
+            if len(batch) < batch_size:
+                return
+            after = (batch[-1].subscription_end, batch[-1].id)
+    
+    def iter_expired_users(self, now, since=None, batch_size=500):
+        return self.iter_users_expiring_between(since, now, batch_size)
+    
+    def iter_expiring_users(self, now, within, since=None, batch_size=500):
+        start = max(since, now) if since else now
+        return self.iter_users_expiring_between(start, now + within, batch_size)
+    
+    def record_proof_archive(self, keys, archive):
+        try:
+            with self.Session() as session:
+                session.add_all([ArchivedProof(key=key, archive=archive) for key in keys])
+                session.commit()
+                return True
         except:
+            return False
+    
+    def get_watermark(self, name):
+        try:
+            with self.Session() as session:
+                state = session.get(SweepState, name)
+                return state.watermark if state else None
+        except:
+            return None
+    
+    def set_watermark(self, name, watermark):
+        try:
+            with self.Session() as session:
+                session.merge(SweepState(name=name, watermark=watermark))
+                session.commit()
+        except:
+            pass
+
+# Asyncio access for the bot handlers: one short-lived session per call
+@instrument_database
+class AsyncDatabase:
+    def __init__(self, database_url=None):
+        self.database_url = database_url
+        self._engine = None
+        self._Session = None
+    
+    def _connect(self):
+        # Only ever called from the event loop, so no lock
+        async_url = get_async_database_url(self.database_url or DATABASE_URL)
+        engine = create_async_engine(async_url, **engine_options(async_url, is_async=True))
+        tune_sqlite(engine.sync_engine)
+        self._Session = async_sessionmaker(engine, expire_on_commit=False)
+        self._engine = engine
+    
+    @property
+    def engine(self):
+        if self._engine is None:
+            self._connect()
+        return self._engine
+    
+    @property
+    def Session(self):
+        if self._Session is None:
+            self._connect()
+        return self._Session
+    
+    async def add_user(self, user_data):
+        try:
+            async with self.Session() as session:
+                user = User(**user_data)
+                session.add(user)
+                await session.commit()
+                user_cache.put(status_of(user))
+                user_cache.publish([user.user_id])
+                return user
+        except Exception:
+            return None
+    
+    async def get_user(self, user_id):
+        try:
+            async with self.Session() as session:
+                result = await session.execute(select(User).filter_by(user_id=user_id))
+                user = result.scalars().first()
+                if user:
+                    user_cache.put(status_of(user))
+                return user
+        except Exception:
+            return None
+    
+    async def get_user_status(self, user_id):
+        # Cached UserStatus for hot paths; None if the user doesn't exist
+        status = user_cache.get(user_id)
+        if status:
+            return status
+        try:
+            async with self.Session() as session:
+                result = await session.execute(
+                    select(User.user_id, User.is_approved, User.is_banned, User.subscription_end)
+                    .filter_by(user_id=user_id)
+                )
+                row = result.first()
+                if not row:
+                    return None
+                status = UserStatus(*row)
+                user_cache.put(status)
+                return status
+        except Exception:
+            return None
+    
+    async def update_user(self, user_id, update_data, outbox=None):
+        # outbox: notices to queue, committed together with the change
+        try:
+            async with self.Session() as session:
+                result = await session.execute(select(User).filter_by(user_id=user_id))
+                user = result.scalars().first()
+                if user:
+                    for key, value in update_data.items():
+                        setattr(user, key, value)
+                    session.add_all(OutboxMessage(**entry) for entry in outbox or [])
+                    await session.commit()
+                    user_cache.put(status_of(user))
+                    user_cache.publish([user_id])
+                    return user
+                return None
+        except Exception:
+            return None
+    
+    async def get_all_users(self):
+        try:
+            async with self.Session() as session:
+                result = await session.execute(select(User))
+                return result.scalars().all()
+        except Exception:
+            return []
+    
+    async def get_pending_approvals(self):
+        try:
+            async with self.Session() as session:
+                result = await session.execute(select(User).filter_by(is_approved=False, is_banned=False))
+                return result.scalars().all()
+        except Exception:
+            return []
+    
+    async def get_pending_page(self, cursor=None, direction='from', limit=10):
+        # Keyset page over the review queue ordered by (created_at, id).
+        # direction: 'next' = after cursor, 'prev' = before cursor, 'from' = at or after cursor.
+        pending = and_(User.is_approved == False, User.is_banned == False)
+        stmt = select(User).where(pending)
+        if cursor:
+            created_at, row_id = cursor
+            if direction == 'prev':
+                stmt = stmt.where(or_(User.created_at < created_at, and_(User.created_at == created_at, User.id < row_id)))
+            elif direction == 'next':
+                stmt = stmt.where(or_(User.created_at > created_at, and_(User.created_at == created_at, User.id > row_id)))
+            else:
+                stmt = stmt.where(or_(User.created_at > created_at, and_(User.created_at == created_at, User.id >= row_id)))
+        if direction == 'prev':
+            stmt = stmt.order_by(User.created_at.desc(), User.id.desc())
+        else:
+            stmt = stmt.order_by(User.created_at, User.id)
+        try:
+            async with self.Session() as session:
+                users = (await session.execute(stmt.limit(limit + 1))).scalars().all()
+                more = len(users) > limit
+                users = users[:limit]
+                if direction == 'prev':
+                    users.reverse()
+                if not users:
+                    return [], False, False
+                if direction == 'prev':
+                    return users, more, True
+                first = users[0]
+                has_prev = await session.scalar(select(exists().where(pending, or_(
+                    User.created_at < first.created_at,
+                    and_(User.created_at == first.created_at, User.id < first.id)
+                ))))
+                return users, has_prev, more
+        except Exception:
+            return [], False, False
+    
+    async def count_pending_approvals(self):
+        try:
+            async with self.Session() as session:
+                return await session.scalar(
+                    select(func.count(User.id)).where(User.is_approved == False, User.is_banned == False)
+                )
+        except Exception:
+            return 0
+    
+    async def get_banned_users(self):
+        try:
+            async with self.Session() as session:
+                result = await session.execute(select(User).filter_by(is_banned=True))
+                return result.scalars().all()
+        except Exception:
             return []
+    
+    async def get_stats(self, days=7):
+        # Status counts in one aggregate query, plus expiries per day for the next `days`
+        now = datetime.now()
+        active = and_(User.is_approved == True, User.is_banned == False, User.subscription_end > now)
+        pending = and_(User.is_approved == False, User.is_banned == False)
+        try:
+            async with self.Session() as session:
+                result = await session.execute(select(
+                    func.count(User.id),
+                    func.count(case((active, 1))),
+                    func.count(case((pending, 1))),
+                    func.count(case((User.is_banned == True, 1))),
+                    func.count(User.claimed_by),
+                    func.count(case((User.claim_expires_at < now, 1)))
+                ))
+                total, active_count, pending_count, banned_count, claimed_count, overdue_count = result.one()
+                
+                day = func.date(User.subscription_end)
+                result = await session.execute(
+                    select(day, func.count(User.id))
+                    .where(active, User.subscription_end <= now + timedelta(days=days))
+                    .group_by(day)
+                    .order_by(day)
+                )
+                return {
+                    'total': total,
+                    'active': active_count,
+                    'pending': pending_count,
+                    'banned': banned_count,
+                    'claimed': claimed_count,
+                    'overdue': overdue_count,
+                    'expiries_per_day': [(str(date), count) for date, count in result.all()]
+                }
+        except Exception:
+            return None
+    
+    async def bulk_update_users(self, user_ids, update_data, outbox=None):
+        # One UPDATE and one commit for the whole set, queued notices included
+        try:
+            async with self.Session() as session:
+                await session.execute(
+                    update(User).where(User.user_id.in_(user_ids)).values(**update_data)
+                )
+                if outbox:
+                    await session.execute(insert(OutboxMessage), outbox)
+                await session.commit()
+                user_cache.invalidate(user_ids)
+                return True
+        except Exception:
+            return False
+    
+    async def decide_pending(self, user_ids, update_data, outbox_for=None):
+        # Bulk approve/reject: in one transaction, apply update_data to whichever of
+        # user_ids are still pending and return (user_id, username) for those rows.
+        # Users another admin action got to first are left alone. None on error.
+        # outbox_for(user_id) gives the notices to queue for each user decided.
+        try:
+            pending_rows = and_(User.user_id.in_(user_ids), User.is_approved == False, User.is_banned == False)
+            async with self.Session() as session:
+                if self.engine.dialect.update_returning:
+                    # One statement: nothing can slip in between finding and updating the rows
+                    result = await session.execute(
+                        update(User).where(pending_rows).values(**update_data)
+                        .returning(User.user_id, User.username)
+                    )
+                    pending = result.all()
+                else:
+                    result = await session.execute(select(User.user_id, User.username).where(pending_rows))
+                    pending = result.all()
+                    if pending:
+                        await session.execute(
+                            update(User).where(pending_rows, User.user_id.in_([user_id for user_id, _ in pending]))
+                            .values(**update_data)
+                        )
+                if outbox_for and pending:
+                    await session.execute(insert(OutboxMessage), [
+                        entry for user_id, _ in pending for entry in outbox_for(user_id)
+                    ])
+                await session.commit()
+                user_cache.invalidate([user_id for user_id, _ in pending])
+                return pending
+        except Exception as e:
+            print(f"Error applying bulk decision: {e}")
+            return None
+    
+    async def decide_claimed(self, user_id, reviewer_id, update_data, now=None, outbox=None):
+        # A reviewer's approve/reject, applied only if they may make it: they hold the
+        # claim, its lease has run out, or it's an unclaimed submission still pending.
+        # The claim is released in the same UPDATE, so a second tap or a button left
+        # over from a reassigned submission matches nothing. Returns (user_id, username),
+        # or None if nothing was decided. outbox is queued only if it was.
+        now = now or datetime.now()
+        allowed = and_(User.user_id == user_id, or_(
+            User.claimed_by == reviewer_id,
+            and_(User.claimed_by != None, User.claim_expires_at < now),
+            and_(User.claimed_by == None, User.is_approved == False, User.is_banned == False)
+        ))
+        values = dict(update_data, claimed_by=None, claim_expires_at=None)
+        try:
+            async with self.Session() as session:
+                if self.engine.dialect.update_returning:
+                    result = await session.execute(
+                        update(User).where(allowed).values(**values).returning(User.user_id, User.username)
+                    )
+                    decided = result.first()
+                else:
+                    result = await session.execute(select(User.user_id, User.username).where(allowed))
+                    decided = result.first()
+                    if decided:
+                        result = await session.execute(update(User).where(allowed).values(**values))
+                        if not result.rowcount:
+                            decided = None
+                if decided and outbox:
+                    session.add_all(OutboxMessage(**entry) for entry in outbox)
+                await session.commit()
+                if decided:
+                    user_cache.invalidate([user_id])
+                return decided
+        except Exception as e:
+            print(f"Error applying review decision: {e}")
+            return None
+    
+    async def get_expired_claims(self, now, limit=100):
+        try:
+            async with self.Session() as session:
+                result = await session.execute(
+                    select(User.user_id, User.username, User.full_name, User.proof_file_id,
+                           User.claimed_by, User.claim_expires_at)
+                    .where(User.claimed_by != None, User.claim_expires_at < now)
+                    .order_by(User.claim_expires_at).limit(limit)
+                )
+                return result.all()
+        except Exception as e:
+            print(f"Error getting expired claims: {e}")
+            return []
+    
+    async def move_claim(self, user_id, old_reviewer, old_expires_at, new_reviewer, new_expires_at):
+        # Compare-and-set on the claim, so two processes can't both reassign it
+        try:
+            async with self.Session() as session:
+                result = await session.execute(
+                    update(User)
+                    .where(User.user_id == user_id, User.claimed_by == old_reviewer,
+                           User.claim_expires_at == old_expires_at)
+                    .values(claimed_by=new_reviewer, claim_expires_at=new_expires_at)
+                )
+                await session.commit()
+                return result.rowcount == 1
+        except Exception as e:
+            print(f"Error moving claim: {e}")
+            return False
+    
+    async def iter_users_expiring_between(self, start, end, batch_size=500, unnotified=None):
+        after = None
+        while True:
+            async with self.Session() as session:
+                result = await session.execute(
+                    expiring_between_stmt(start, end, after, batch_size, unnotified)
+                )
+                batch = result.scalars().all()
+            if not batch:
+                return
+            yield batch
+            if len(batch) < batch_size:
+                return
+            after = (batch[-1].subscription_end, batch[-1].id)
+    
+    def iter_expired_users(self, now, since=None, batch_size=500):
+        return self.iter_users_expiring_between(since, now, batch_size)
+    
+    async def stream_users(self, stmt, batch_size=1000):
+        # Rows of stmt in batches through a server-side cursor, so only one batch is
+        # ever held in memory
+        async with self.Session() as session:
+            result = await session.stream(stmt.execution_options(yield_per=batch_size))
+            async for batch in result.partitions():
+                yield batch
+    
+    async def get_subscription_ends(self, start, end):
+        # (user_id, subscription_end) pairs for approved users with start < subscription_end <= end
+        try:
+            async with self.Session() as session:
+                result = await session.execute(
+                    select(User.user_id, User.subscription_end).where(
+                        User.is_approved == True,
+                        User.subscription_end > start,
+                        User.subscription_end <= end
+                    )
+                )
+                return result.all()
+        except Exception:
+            return []
+    
+    async def record_notifications(self, entries):
+        # entries: dicts with user_id, kind and period_end
+        if not entries:
+            return True
+        try:
+            async with self.Session() as session:
+                await session.execute(insert(Notification), entries)
+                await session.commit()
+                return True
+        except IntegrityError:
+            # Some were recorded already; keep the rest
+            for entry in entries:
+                try:
+                    async with self.Session() as session:
+                        session.add(Notification(**entry))
+                        await session.commit()
+                except IntegrityError:
+                    pass
+            return True
+        except Exception:
+            return False
+    
+    async def enqueue(self, outbox, notifications=None):
+        # Queue notices, with the ledger rows that stop them being sent twice. Each
+        # notice commits with its ledger row, so a duplicate only drops its own notice.
+        if not outbox:
+            return True
+        try:
+            async with self.Session() as session:
+                if notifications:
+                    await session.execute(insert(Notification), notifications)
+                await session.execute(insert(OutboxMessage), outbox)
+                await session.commit()
+                return True
+        except IntegrityError:
+            for entry, notification in zip(outbox, notifications):
+                try:
+                    async with self.Session() as session:
+                        session.add(Notification(**notification))
+                        session.add(OutboxMessage(**entry))
+                        await session.commit()
+                except IntegrityError:
+                    pass
+            return True
+        except Exception as e:
+            print(f"Error queueing notices: {e}")
+            return False
+    
+    async def claim_outbox(self, now, limit, lease):
+        # Due outbox rows for delivery. Their next attempt is pushed past the lease
+        # first, so another process (or a crash mid-send) can't deliver them twice
+        # before it runs out.
+        try:
+            async with self.Session() as session:
+                due = (select(OutboxMessage.id)
+                       .where(OutboxMessage.status == 'pending', OutboxMessage.next_attempt_at <= now)
+                       .order_by(OutboxMessage.next_attempt_at).limit(limit))
+                lease_until = now + timedelta(seconds=lease)
+                if self.engine.dialect.update_returning:
+                    result = await session.execute(
+                        update(OutboxMessage)
+                        .where(OutboxMessage.id.in_(due.scalar_subquery()), OutboxMessage.status == 'pending',
+                               OutboxMessage.next_attempt_at <= now)
+                        .values(next_attempt_at=lease_until, attempts=OutboxMessage.attempts + 1)
+                        .returning(OutboxMessage)
+                    )
+                    claimed = result.scalars().all()
+                else:
+                    ids = (await session.execute(due)).scalars().all()
+                    if not ids:
+                        return []
+                    await session.execute(
+                        update(OutboxMessage)
+                        .where(OutboxMessage.id.in_(ids), OutboxMessage.next_attempt_at <= now)
+                        .values(next_attempt_at=lease_until, attempts=OutboxMessage.attempts + 1)
+                    )
+                    result = await session.execute(
+                        select(OutboxMessage).where(OutboxMessage.id.in_(ids), OutboxMessage.next_attempt_at == lease_until)
+                    )
+                    claimed = result.scalars().all()
+                await session.commit()
+                return sorted(claimed, key=lambda row: row.id)
+        except Exception as e:
+            print(f"Error claiming outbox: {e}")
+            return []
+    
+    async def finish_outbox(self, sent_ids, retries, dead):
+        # One transaction for a batch's results. retries: (id, next_attempt_at, error);
+        # dead: (id, error)
+        now = datetime.now()
+        try:
+            async with self.Session() as session:
+                if sent_ids:
+                    await session.execute(
+                        update(OutboxMessage).where(OutboxMessage.id.in_(sent_ids))
+                        .values(status='sent', sent_at=now, last_error=None)
+                    )
+                for message_id, next_attempt_at, error in retries:
+                    await session.execute(
+                        update(OutboxMessage).where(OutboxMessage.id == message_id)
+                        .values(next_attempt_at=next_attempt_at, last_error=error)
+                    )
+                for message_id, error in dead:
+                    await session.execute(
+                        update(OutboxMessage).where(OutboxMessage.id == message_id)
+                        .values(status='dead', last_error=error)
+                    )
+                await session.commit()
+                return True
+        except Exception as e:
+            print(f"Error recording outbox results: {e}")
+            return False
+    
+    async def get_outbox_stats(self):
+        try:
+            async with self.Session() as session:
+                result = await session.execute(
+                    select(OutboxMessage.status, func.count()).group_by(OutboxMessage.status)
+                )
+                counts = dict(result.all())
+                return {status: counts.get(status, 0) for status in ('pending', 'sent', 'dead')}
+        except Exception:
+            return {'pending': 0, 'sent': 0, 'dead': 0}
+    
+    async def purge_outbox(self, before):
+        # Delivered rows are only kept for a while; dead letters stay for the admin to look at
+        try:
+            async with self.Session() as session:
+                result = await session.execute(
+                    delete(OutboxMessage).where(OutboxMessage.status == 'sent', OutboxMessage.sent_at < before)
+                )
+                await session.commit()
+                return result.rowcount
+        except Exception:
+            return 0
+    
+    async def load_state(self, kind, key):
+        try:
+            async with self.Session() as session:
+                state = await session.get(ConversationState, (kind, key))
+                return state.data if state else None
+        except Exception:
+            return None
+    
+    async def save_states(self, states):
+        # states: {(kind, key): pickled bytes, or None to delete}, written in one transaction
+        try:
+            async with self.Session() as session:
+                by_kind = {}
+                for (kind, key), data in states.items():
+                    by_kind.setdefault(kind, []).append((key, data))
+                for kind, entries in by_kind.items():
+                    await session.execute(delete(ConversationState).where(
+                        ConversationState.kind == kind,
+                        ConversationState.key.in_([key for key, _ in entries])
+                    ))
+                    rows = [
+                        {'kind': kind, 'key': key, 'data': data, 'updated_at': datetime.now()}
+                        for key, data in entries if data is not None
+                    ]
+                    if rows:
+                        await session.execute(insert(ConversationState), rows)
+                await session.commit()
+                return True
+        except Exception as e:
+            print(f"Error saving conversation state: {e}")
+            return False
+    
+    async def get_proof_archive(self, key):
+        try:
+            async with self.Session() as session:
+                archived = await session.get(ArchivedProof, key)
+                return archived.archive if archived else None
+        except Exception:
+            return None
+    
+    async def get_media_file_id(self, source):
+        try:
+            async with self.Session() as session:
+                media = await session.get(MediaFile, source)
+                return media.file_id if media else None
+        except Exception as e:
+            print(f"Error getting media file id: {e}")
+            return None
+    
+    async def set_media_file_id(self, source, file_id):
+        try:
+            async with self.Session() as session:
+                if file_id is None:
+                    await session.execute(delete(MediaFile).where(MediaFile.source == source))
+                else:
+                    await session.merge(MediaFile(source=source, file_id=file_id))
+                await session.commit()
+                return True
+        except Exception as e:
+            print(f"Error saving media file id: {e}")
+            return False
+    
+    async def get_proof_hash(self, proof_key):
+        # Chunks already computed for these exact bytes, if anyone sent them before
+        try:
+            async with self.Session() as session:
+                result = await session.execute(
+                    select(ProofHash.h0, ProofHash.h1, ProofHash.h2, ProofHash.h3)
+                    .where(ProofHash.proof_key == proof_key).limit(1)
+                )
+                row = result.first()
+                return tuple(row) if row else None
+        except Exception as e:
+            print(f"Error getting proof hash: {e}")
+            return None
+    
+    async def find_proof_hashes(self, candidates, exclude_user_id=None, limit=5000):
+        # Rows whose chunk i is one of candidates[i] for any i; every chunk column is indexed
+        try:
+            async with self.Session() as session:
+                columns = (ProofHash.h0, ProofHash.h1, ProofHash.h2, ProofHash.h3)
+                stmt = select(ProofHash.user_id, *columns, ProofHash.created_at).where(
+                    or_(*(column.in_(values) for column, values in zip(columns, candidates)))
+                )
+                if exclude_user_id is not None:
+                    stmt = stmt.where(ProofHash.user_id != exclude_user_id)
+                result = await session.execute(stmt.limit(limit))
+                return result.all()
+        except Exception as e:
+            print(f"Error finding proof hashes: {e}")
+            return []
+    
+    async def add_proof_hash(self, user_id, proof_key, chunks):
+        try:
+            async with self.Session() as session:
+                h0, h1, h2, h3 = chunks
+                session.add(ProofHash(user_id=user_id, proof_key=proof_key, h0=h0, h1=h1, h2=h2, h3=h3))
+                await session.commit()
+                return True
+        except IntegrityError:
+            # Same user sending the same bytes again
+            return True
+        except Exception as e:
+            print(f"Error saving proof hash: {e}")
+            return False
+    
+    async def get_watermark(self, name):
+        try:
+            async with self.Session() as session:
+                state = await session.get(SweepState, name)
+                return state.watermark if state else None
+        except Exception:
+            return None
+    
+    async def set_watermark(self, name, watermark):
+        try:
+            async with self.Session() as session:
+                await session.merge(SweepState(name=name, watermark=watermark))
+                await session.commit()
+        except Exception:
+            pass
 
-db = Database()
\ No newline at end of file
+db = Database()
+async_db = AsyncDatabase()
\ No newline at end of file
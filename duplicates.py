@@ -0,0 +1,120 @@
+import asyncio
+import contextlib
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from database import async_db
+from config import ADMIN_ID, DUPLICATE_CHECK_ENABLED, DUPLICATE_MAX_DISTANCE, HASH_WORKERS
+from image_hash import Image, CHUNKS, dhash, split, join, neighbours
+
+class DuplicateCheck:
+    def __init__(self):
+        self.done = asyncio.get_running_loop().create_future()
+        # Set when the admin was notified before this finished
+        self.late = False
+
+class DuplicateDetector:
+    # Flags proofs that look like one another user already sent. Images are decoded
+    # and hashed in a process pool, never on the event loop. Lookups use multi-index
+    # hashing: the 64-bit hash is stored as four indexed 16-bit chunks, and two hashes
+    # within distance d have a chunk within d // 4 bits of each other, so a lookup is
+    # a few index probes however many proofs are stored.
+    def __init__(self, max_distance=DUPLICATE_MAX_DISTANCE, workers=HASH_WORKERS):
+        self.max_distance = max_distance
+        self.workers = workers
+        self.pool = None
+        # user_id -> check of their latest proof, until the admin notification reads it
+        self.checks = {}
+        self.enabled = DUPLICATE_CHECK_ENABLED
+        if self.enabled and Image is None:
+            print("Pillow not installed, duplicate proof checks disabled")
+            self.enabled = False
+
+    def executor(self):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self.pool
+
+    async def find(self, user_id, key, path):
+        # Hash and record a stored proof; returns [(distance, user_id)] of other users' proofs like it
+        chunks = await async_db.get_proof_hash(key)
+        if chunks is None:
+            value = await asyncio.get_running_loop().run_in_executor(self.executor(), dhash, path)
+            chunks = split(value)
+        value = join(chunks)
+        radius = self.max_distance // CHUNKS
+        rows = await async_db.find_proof_hashes([neighbours(chunk, radius) for chunk in chunks], exclude_user_id=user_id)
+        closest = {}
+        for row in rows:
+            distance = (join(row[1:5]) ^ value).bit_count()
+            if distance <= self.max_distance and distance < closest.get(row.user_id, distance + 1):
+                closest[row.user_id] = distance
+        await async_db.add_proof_hash(user_id, key, chunks)
+        return sorted((distance, other) for other, distance in closest.items())
+
+    @contextlib.asynccontextmanager
+    async def checking(self, bot, user_id):
+        # Wraps storing a proof so the admin notification can wait for the result.
+        # The body sets check.matches once the proof is stored.
+        check = DuplicateCheck()
+        check.matches = []
+        if self.enabled:
+            self.checks[user_id] = check
+        try:
+            yield check
+        finally:
+            check.done.set_result(check.matches)
+            if check.late:
+                self.checks.pop(user_id, None)
+                if check.matches:
+                    await self.warn_admin(bot, user_id, check.matches)
+
+    async def check(self, user_id, key, path):
+        if not self.enabled:
+            return []
+        try:
+            return await self.find(user_id, key, path)
+        except Exception as e:
+            print(f"Duplicate check error for {user_id}: {e}")
+            return []
+
+    async def matches_for(self, user_id, timeout=2):
+        # Matches for the user's latest proof, waiting briefly for a check still running.
+        # If it takes longer the notification goes without, and the check warns the admin itself.
+        check = self.checks.get(user_id)
+        if check is None:
+            return []
+        try:
+            matches = await asyncio.wait_for(asyncio.shield(check.done), timeout)
+        except asyncio.TimeoutError:
+            check.late = True
+            return []
+        if self.checks.get(user_id) is check:
+            del self.checks[user_id]
+        return matches
+
+    async def warn_admin(self, bot, user_id, matches):
+        # To whoever holds the submission now, or the admin once nobody does
+        user = await async_db.get_user(user_id)
+        reviewer_id = ADMIN_ID
+        if user and user.claimed_by and user.claim_expires_at and user.claim_expires_at > datetime.now():
+            reviewer_id = user.claimed_by
+        try:
+            await bot.send_message(chat_id=reviewer_id, text=f"Payment proof from {user_id}{describe(matches)}")
+        except Exception as e:
+            print(f"Error sending duplicate warning: {e}")
+
+    def stop(self):
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+def describe(matches, limit=5):
+    # Line for the admin's notification; empty when nothing matched
+    if not matches:
+        return ''
+    listed = ', '.join(f"{user_id} ({distance} bits apart)" for distance, user_id in matches[:limit])
+    more = f" and {len(matches) - limit} more" if len(matches) > limit else ''
+    return f"\n⚠️ Looks like a receipt already sent by: {listed}{more}"
+
+duplicate_detector = DuplicateDetector()
@@ -0,0 +1,125 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+from telegram import Update
+from telegram.ext import ContextTypes
+from database import async_db, export_users_stmt, EXPORT_COLUMNS
+
+STATUSES = ('all', 'active', 'expired', 'pending', 'banned')
+DATE_FIELDS = {'created': 'created_at', 'expiry': 'subscription_end'}
+# Telegram's limit on files a bot uploads
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+
+USAGE = (
+    "Usage: /export [csv|jsonl] [all|active|expired|pending|banned] "
+    "[from=YYYY-MM-DD] [to=YYYY-MM-DD] [by=created|expiry]\n"
+    "e.g. /export csv active from=2026-01-01 to=2026-02-01 by=expiry"
+)
+
+def parse_export_args(args):
+    # Returns the options dict, or None if anything is unrecognised
+    options = {'format': 'csv', 'status': 'all', 'date_field': 'created_at', 'start': None, 'end': None}
+    try:
+        for arg in args:
+            arg = arg.lower()
+            if arg in ('csv', 'jsonl'):
+                options['format'] = arg
+            elif arg in STATUSES:
+                options['status'] = arg
+            elif arg.startswith('from='):
+                options['start'] = datetime.strptime(arg[len('from='):], '%Y-%m-%d')
+            elif arg.startswith('to='):
+                options['end'] = datetime.strptime(arg[len('to='):], '%Y-%m-%d')
+            elif arg.startswith('by=') and arg[len('by='):] in DATE_FIELDS:
+                options['date_field'] = DATE_FIELDS[arg[len('by='):]]
+            else:
+                return None
+    except ValueError:
+        return None
+    return options
+
+def _value(value):
+    return value.isoformat(sep=' ', timespec='seconds') if isinstance(value, datetime) else value
+
+class ExportWriter:
+    # Gzipped CSV or JSON Lines written one batch at a time
+    def __init__(self, path, fmt):
+        self.file = gzip.open(path, 'wt', encoding='utf-8', newline='', compresslevel=6)
+        self.fmt = fmt
+        if fmt == 'csv':
+            self.csv = csv.writer(self.file)
+            self.csv.writerow(EXPORT_COLUMNS)
+
+    def write(self, rows):
+        if self.fmt == 'csv':
+            self.csv.writerows([_value(value) for value in row] for row in rows)
+        else:
+            buffer = io.StringIO()
+            for row in rows:
+                buffer.write(json.dumps({name: _value(value) for name, value in zip(EXPORT_COLUMNS, row)}, ensure_ascii=False))
+                buffer.write('\n')
+            self.file.write(buffer.getvalue())
+
+    def close(self):
+        self.file.close()
+
+async def write_export(path, options, batch_size=1000):
+    # Stream matching users into path; returns the row count. Compression runs in a
+    # thread one batch at a time, so memory stays at one batch whatever the table size.
+    stmt = export_users_stmt(options['status'], options['date_field'], options['start'], options['end'])
+    writer = await asyncio.to_thread(ExportWriter, path, options['format'])
+    count = 0
+    try:
+        async for batch in async_db.stream_users(stmt, batch_size):
+            await asyncio.to_thread(writer.write, batch)
+            count += len(batch)
+    finally:
+        await asyncio.to_thread(writer.close)
+    return count
+
+export_lock = asyncio.Lock()
+
+async def export_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != context.bot_data['admin_id']:
+        await update.message.reply_text("❌ Only the admin can export users.")
+        return
+
+    options = parse_export_args(context.args or [])
+    if options is None:
+        await update.message.reply_text(USAGE)
+        return
+    if export_lock.locked():
+        await update.message.reply_text("⏳ An export is already running.")
+        return
+
+    async with export_lock:
+        status = await update.message.reply_text("⏳ Exporting users...")
+        filename = f"users-{options['status']}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{options['format']}.gz"
+        fd, path = tempfile.mkstemp(suffix='.gz')
+        os.close(fd)
+        try:
+            started = time.perf_counter()
+            count = await write_export(path, options)
+            size = os.path.getsize(path)
+            if size > MAX_UPLOAD_BYTES:
+                await status.edit_text(f"❌ Export of {count} users is {size / 1048576:.0f} MB, over Telegram's 50 MB limit. Narrow the filters.")
+                return
+            with open(path, 'rb') as f:
+                await context.bot.send_document(
+                    chat_id=update.effective_chat.id,
+                    document=f,
+                    filename=filename,
+                    caption=f"📦 {count} users ({options['status']}) in {time.perf_counter() - started:.1f}s"
+                )
+            await status.delete()
+        except Exception as e:
+            print(f"Export error: {e}")
+            await status.edit_text("❌ Export failed. Please try again.")
+        finally:
+            os.remove(path)
@@ -0,0 +1,118 @@
+import time
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, TypeHandler
+from database import async_db
+from rate_limiter import TokenBucket
+from metrics import registry, Counter, CallbackGauge
+from config import ADMIN_IDS, FLOOD_LIMITS, PROOF_DEBOUNCE_SECONDS
+
+flood_dropped = registry.register(Counter(
+    'bot_flood_dropped_total', "Updates dropped by inbound flood control", ('kind', 'reason')))
+
+def update_kind(update):
+    if update.callback_query:
+        return 'callback'
+    message = update.message or update.edited_message
+    if message is None:
+        return None
+    if message.photo:
+        return 'photo'
+    if message.text and message.text.startswith('/'):
+        return 'command'
+    return 'text'
+
+class FloodControl:
+    # Runs in handler group -1, ahead of every handler: a token bucket per user and
+    # kind of update, and a debounce on proofs while the last one awaits review.
+    # Anything over the limit stops here with ApplicationHandlerStop, before any
+    # download, DB write or admin message. Reviewers are never throttled.
+    def __init__(self, limits=FLOOD_LIMITS, proof_debounce=PROOF_DEBOUNCE_SECONDS, exempt_ids=ADMIN_IDS,
+                 notice_interval=60, prune_interval=300):
+        self.limits = limits
+        self.proof_debounce = proof_debounce
+        self.exempt_ids = set(exempt_ids)
+        self.notice_interval = notice_interval
+        self.prune_interval = prune_interval
+        self.next_prune = time.monotonic() + prune_interval
+        # (user_id, kind) -> TokenBucket; full buckets are pruned, so this holds recent senders only
+        self.buckets = {}
+        # user_id -> when their last proof was submitted for review
+        self.submitted = {}
+        # user_id -> when they may be told to slow down again
+        self.noticed = {}
+        self.passed = 0
+        self.dropped = {}
+
+    def handler(self):
+        return TypeHandler(Update, self.check)
+
+    async def check(self, update, context):
+        user = update.effective_user
+        kind = update_kind(update) if isinstance(update, Update) else None
+        if user is None or kind is None or user.id in self.exempt_ids:
+            return
+        now = time.monotonic()
+        if now >= self.next_prune:
+            self.prune(now)
+
+        if kind == 'photo' and await self.review_pending(user.id, now):
+            await self.drop(update, kind, 'pending', "⏳ Your payment is already under review. You'll be notified once it's checked.")
+        bucket = self.buckets.get((user.id, kind))
+        if bucket is None:
+            per_minute = self.limits[kind]
+            bucket = self.buckets[(user.id, kind)] = TokenBucket(per_minute / 60, per_minute)
+        if not bucket.take(now):
+            await self.drop(update, kind, 'rate', "⏳ You're sending messages too fast. Please wait a moment.")
+        self.passed += 1
+
+    async def review_pending(self, user_id, now):
+        # Only users who submitted recently cost a lookup, and that is usually cached
+        submitted = self.submitted.get(user_id)
+        if submitted is None or now - submitted > self.proof_debounce:
+            return False
+        status = await async_db.get_user_status(user_id)
+        if status and not status.is_approved and not status.is_banned:
+            return True
+        # Decided since: a new proof is welcome
+        del self.submitted[user_id]
+        return False
+
+    def proof_submitted(self, user_id):
+        # Called once a proof has gone to the admin
+        self.submitted[user_id] = time.monotonic()
+
+    async def drop(self, update, kind, reason, notice):
+        self.dropped[(kind, reason)] = self.dropped.get((kind, reason), 0) + 1
+        flood_dropped.inc((kind, reason))
+        # One notice per user per interval; everything else is dropped silently
+        user_id = update.effective_user.id
+        now = time.monotonic()
+        if update.message and self.noticed.get(user_id, 0) <= now:
+            self.noticed[user_id] = now + self.notice_interval
+            try:
+                await update.message.reply_text(notice)
+            except Exception as e:
+                print(f"Flood notice error: {e}")
+        raise ApplicationHandlerStop
+
+    def prune(self, now):
+        self.buckets = {key: bucket for key, bucket in self.buckets.items() if not bucket.is_full(now)}
+        self.submitted = {user_id: at for user_id, at in self.submitted.items() if now - at <= self.proof_debounce}
+        self.noticed = {user_id: until for user_id, until in self.noticed.items() if until > now}
+        self.next_prune = now + self.prune_interval
+
+    def get_stats(self):
+        by_kind = {}
+        for (kind, reason), count in self.dropped.items():
+            by_kind[kind] = by_kind.get(kind, 0) + count
+        return {
+            'passed': self.passed,
+            'dropped': sum(self.dropped.values()),
+            'dropped_by_kind': by_kind,
+            'debounced_proofs': self.dropped.get(('photo', 'pending'), 0),
+            'tracked': len(self.buckets),
+        }
+
+flood_control = FloodControl()
+registry.register(CallbackGauge(
+    'bot_flood_tracked_buckets', "Per-user flood control buckets held in memory", lambda: len(flood_control.buckets)))
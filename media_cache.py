@@ -0,0 +1,72 @@
+import asyncio
+import os
+import time
+from telegram.error import BadRequest
+from database import async_db
+
+class MediaCache:
+    # Telegram file_ids for media the bot sends over and over. The first send uploads
+    # the file (or has Telegram fetch the URL); every later send just names the
+    # file_id. Ids are kept in the database so restarts and other workers reuse them.
+    def __init__(self, retry_after=3600):
+        self.file_ids = {}
+        self.uploads = {}
+        # Sources Telegram refused, not retried until the time stored here
+        self.failed_until = {}
+        self.retry_after = retry_after
+
+    async def get(self, source):
+        file_id = self.file_ids.get(source)
+        if file_id is None:
+            file_id = await async_db.get_media_file_id(source)
+            if file_id:
+                self.file_ids[source] = file_id
+        return file_id
+
+    async def forget(self, source):
+        self.file_ids.pop(source, None)
+        await async_db.set_media_file_id(source, None)
+
+    async def send_video(self, bot, chat_id, source, **kwargs):
+        # Returns the sent message, or None when there's no video to send
+        if not source or self.failed_until.get(source, 0) > time.monotonic():
+            return None
+
+        file_id = await self.get(source)
+        if file_id:
+            try:
+                return await bot.send_video(chat_id, file_id, **kwargs)
+            except BadRequest as e:
+                # file_ids belong to one bot, so a new token invalidates them
+                print(f"Cached file id for {source} rejected: {e}")
+                await self.forget(source)
+
+        # One upload per source at a time; sends arriving meanwhile wait for its file_id
+        upload = self.uploads.get(source)
+        if upload:
+            file_id = await asyncio.shield(upload)
+            return await bot.send_video(chat_id, file_id, **kwargs) if file_id else None
+
+        upload = self.uploads[source] = asyncio.get_running_loop().create_future()
+        file_id = None
+        try:
+            if os.path.isfile(source):
+                with open(source, 'rb') as f:
+                    message = await bot.send_video(chat_id, f, **kwargs)
+            else:
+                message = await bot.send_video(chat_id, source, **kwargs)
+            if message.video:
+                file_id = message.video.file_id
+                self.file_ids[source] = file_id
+                await async_db.set_media_file_id(source, file_id)
+            return message
+        except BadRequest as e:
+            # e.g. a page URL rather than a video file: don't ask Telegram again for a while
+            print(f"Video error: {e}")
+            self.failed_until[source] = time.monotonic() + self.retry_after
+            return None
+        finally:
+            upload.set_result(file_id)
+            del self.uploads[source]
+
+media_cache = MediaCache()
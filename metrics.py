@@ -0,0 +1,231 @@
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import time
+from bisect import bisect_left
+from aiohttp import web
+from telegram.request import HTTPXRequest
+from config import METRICS_ENABLED, METRICS_LISTEN, METRICS_PORT, TRACE_UPDATES, TRACE_MIN_MS
+
+# Seconds; covers a cached lookup up to a slow Telegram call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _labels(names, values):
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+
+class Histogram:
+    # Plain counters per label set, rendered cumulatively at scrape time so
+    # observe() stays a bisect and three additions
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in list(self.series.items()):
+            label_text = _labels(self.labelnames, labels)
+            prefix = f"{label_text}," if label_text else ''
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+            suffix = f"{{{label_text}}}" if label_text else ''
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return lines
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values = {}
+
+    def inc(self, labels=(), amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in list(self.values.items()):
+            label_text = _labels(self.labelnames, labels)
+            lines.append(f"{self.name}{{{label_text}}} {value}" if label_text else f"{self.name} {value}")
+        return lines
+
+class CallbackGauge:
+    # Value read at scrape time, for state other modules already keep
+    def __init__(self, name, help, read, kind='gauge'):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.kind = kind
+
+    def render(self):
+        try:
+            value = self.read()
+        except Exception:
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", f"{self.name} {value}"]
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+handler_seconds = registry.register(Histogram(
+    'bot_handler_seconds', "Time spent in each update handler", ('handler',)))
+db_seconds = registry.register(Histogram(
+    'bot_db_query_seconds', "Database method call duration", ('method',)))
+api_seconds = registry.register(Histogram(
+    'bot_telegram_api_seconds', "Telegram Bot API call duration", ('method',)))
+api_responses = registry.register(Counter(
+    'bot_telegram_api_responses_total', "Telegram Bot API responses by method and HTTP status", ('method', 'status')))
+sweep_seconds = registry.register(Histogram(
+    'bot_sweep_seconds', "Subscription sweep duration", (), (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900)))
+sweep_users = registry.register(Counter(
+    'bot_sweep_users_total', "Users handled by subscription sweeps", ('action',)))
+
+# Per-update trace: a list of (kind, name, milliseconds) spans while TRACE_UPDATES is on
+current_trace = contextvars.ContextVar('current_trace', default=None)
+trace_log = logging.getLogger('trace')
+
+def _record_span(kind, name, seconds):
+    spans = current_trace.get()
+    if spans is not None:
+        spans.append((kind, name, round(seconds * 1000, 2)))
+
+def timed_handler(name):
+    # Latency histogram per handler; with TRACE_UPDATES, one log line per update
+    # listing the DB and API calls it made
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(update, context):
+            token = current_trace.set([]) if TRACE_UPDATES else None
+            started = time.perf_counter()
+            try:
+                return await handler(update, context)
+            finally:
+                elapsed = time.perf_counter() - started
+                handler_seconds.observe((name,), elapsed)
+                if token is not None:
+                    spans = current_trace.get()
+                    current_trace.reset(token)
+                    if elapsed * 1000 >= TRACE_MIN_MS:
+                        trace_log.info(json.dumps({
+                            'update_id': getattr(update, 'update_id', None),
+                            'handler': name,
+                            'ms': round(elapsed * 1000, 2),
+                            'spans': spans
+                        }))
+        return wrapper
+    return decorator
+
+def instrument_database(cls):
+    # Time every public method of a database class, sync or async. Async generators
+    # (the sweep iterators) are left alone; the sweep is timed as a whole.
+    for name, method in list(vars(cls).items()):
+        if name.startswith('_') or not callable(method):
+            continue
+        if inspect.isasyncgenfunction(method):
+            continue
+        if inspect.iscoroutinefunction(method):
+            wrapper = _timed_coroutine(name, method)
+        else:
+            wrapper = _timed_function(name, method)
+        setattr(cls, name, wrapper)
+    return cls
+
+def _timed_coroutine(name, method):
+    labels = (name,)
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            db_seconds.observe(labels, elapsed)
+            _record_span('db', name, elapsed)
+    return wrapper
+
+def _timed_function(name, method):
+    labels = (name,)
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            db_seconds.observe(labels, time.perf_counter() - started)
+    return wrapper
+
+class InstrumentedRequest(HTTPXRequest):
+    # Every Bot API call passes through do_request; the method is the last URL segment
+    async def do_request(self, url, method, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            status, payload = await super().do_request(url, method, *args, **kwargs)
+            return status, payload
+        finally:
+            elapsed = time.perf_counter() - started
+            api_seconds.observe((api_method,), elapsed)
+            api_responses.inc((api_method, str(status)))
+            _record_span('api', api_method, elapsed)
+
+class MetricsServer:
+    # Local /metrics endpoint in Prometheus text format
+    def __init__(self, listen=METRICS_LISTEN, port=METRICS_PORT):
+        self.listen = listen
+        self.port = port
+        self.runner = None
+
+    async def handle_metrics(self, request):
+        return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    async def start(self):
+        if not METRICS_ENABLED or self.runner:
+            return
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle_metrics)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        try:
+            await web.TCPSite(self.runner, self.listen, self.port).start()
+            print(f"📈 Metrics on http://{self.listen}:{self.port}/metrics")
+        except OSError as e:
+            print(f"Metrics endpoint not started: {e}")
+            await self.stop()
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+metrics_server = MetricsServer()
@@ -0,0 +1,103 @@
+import time
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, DateTime, select, insert, func, inspect, text
+from sqlalchemy.exc import OperationalError, IntegrityError, ProgrammingError
+from database import Base, User, MediaFile, ProofHash, OutboxMessage, db
+
+# Applied versions, one row each
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+
+    version = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    applied_at = Column(DateTime, default=datetime.now)
+
+# The schema at version 1. Fixed: later tables, columns and indexes belong to the
+# migrations that introduced them, which may not have run yet.
+INITIAL_TABLES = ('users', 'sweep_state', 'notifications', 'archived_proofs', 'conversation_state')
+INITIAL_INDEXES = ('ix_users_status', 'ix_users_review_queue', 'ix_users_subscription_end')
+
+def initial_schema(connection):
+    # Also brings databases from before versioning (made by create_all at boot) up
+    # to date, since every step only adds what's missing
+    for name in INITIAL_TABLES:
+        Base.metadata.tables[name].create(connection, checkfirst=True)
+    for name in INITIAL_INDEXES:
+        create_index(User, name)(connection)
+
+def create_table(model):
+    def apply(connection):
+        model.__table__.create(connection, checkfirst=True)
+    return apply
+
+def create_index(model, name):
+    def apply(connection):
+        next(index for index in model.__table__.indexes if index.name == name).create(connection, checkfirst=True)
+    return apply
+
+def steps(*applies):
+    def apply(connection):
+        for step in applies:
+            step(connection)
+    return apply
+
+def add_column(table, column, ddl_type):
+    # ddl_type is raw DDL or a SQLAlchemy type, compiled for the connected database
+    def apply(connection):
+        if column not in {c['name'] for c in inspect(connection).get_columns(table)}:
+            ddl = ddl_type if isinstance(ddl_type, str) else ddl_type.compile(dialect=connection.dialect)
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    return apply
+
+# (version, name, apply). Append only; each step checks before it changes anything.
+MIGRATIONS = [
+    (1, "initial schema", initial_schema),
+    (2, "users.phone_number", add_column('users', 'phone_number', "VARCHAR DEFAULT ''")),
+    (3, "media_files", create_table(MediaFile)),
+    (4, "proof_hashes", create_table(ProofHash)),
+    (5, "users review claims", steps(
+        add_column('users', 'proof_file_id', String()),
+        add_column('users', 'claimed_by', Integer()),
+        add_column('users', 'claim_expires_at', DateTime()),
+        create_index(User, 'ix_users_claim_expires'),
+    )),
+    (6, "outbox", create_table(OutboxMessage)),
+    # Missing from migration 1 for a while, so databases upgraded then lack it
+    (7, "users.subscription_end index", create_index(User, 'ix_users_subscription_end')),
+]
+
+def current_version(engine):
+    with engine.connect() as connection:
+        return connection.scalar(select(func.max(SchemaVersion.version))) or 0
+
+def migrate(engine=None, attempts=3):
+    # Apply pending migrations in order; returns the versions applied here. Several
+    # processes may run this at once: whoever loses a race re-reads the version.
+    engine = engine or db.engine
+    started = time.perf_counter()
+    for attempt in range(attempts):
+        try:
+            SchemaVersion.__table__.create(engine, checkfirst=True)
+            break
+        except OperationalError:
+            if attempt == attempts - 1:
+                raise
+
+    applied = []
+    for version, name, apply in MIGRATIONS:
+        for attempt in range(attempts):
+            if current_version(engine) >= version:
+                break
+            try:
+                with engine.begin() as connection:
+                    apply(connection)
+                    connection.execute(insert(SchemaVersion).values(version=version, name=name, applied_at=datetime.now()))
+                applied.append(version)
+                print(f"🗄 Migration {version} applied: {name}")
+                break
+            except (OperationalError, IntegrityError, ProgrammingError):
+                if attempt == attempts - 1:
+                    raise
+
+    print(f"🗄 Schema at version {current_version(engine)} ({(time.perf_counter() - started) * 1000:.0f}ms)")
+    return applied
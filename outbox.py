@@ -0,0 +1,161 @@
+import asyncio
+import random
+from datetime import datetime, timedelta
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+from database import async_db
+from metrics import registry, Counter
+from config import ADMIN_ID, CHANNEL_ID, OUTBOX_CONCURRENCY, OUTBOX_BATCH_SIZE, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETENTION_DAYS
+
+outbox_deliveries = registry.register(Counter(
+    'bot_outbox_deliveries_total', "Outbox delivery attempts by kind and result", ('kind', 'result')))
+
+# Outbox entries, passed to the database call that makes the change they announce
+def notify(chat_id, text, kind='notice'):
+    return {'chat_id': chat_id, 'action': 'message', 'kind': kind, 'text': text}
+
+def invite(user_id, text, kind='invite'):
+    # text plus a single-use link into the channel, lifting any earlier ban first
+    return {'chat_id': user_id, 'action': 'invite', 'kind': kind, 'text': text}
+
+def error_text(error):
+    return f"{type(error).__name__}: {error}"[:500]
+
+class OutboxDelivery:
+    # Drains the outbox table: due rows are claimed a batch at a time, sent by up to
+    # `concurrency` tasks, and their results written back in one transaction. Failures
+    # Telegram may recover from are retried with exponential backoff and jitter; the
+    # rest, and anything still failing after max_attempts, are dead-lettered. Rows are
+    # committed with the change they announce, so nothing is lost to a crash or restart.
+    def __init__(self, concurrency=OUTBOX_CONCURRENCY, batch_size=OUTBOX_BATCH_SIZE, max_attempts=OUTBOX_MAX_ATTEMPTS,
+                 retention_days=OUTBOX_RETENTION_DAYS, base_delay=2, max_delay=3600, poll_interval=1, lease=300):
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retention = timedelta(days=retention_days)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        # A claimed row is retried after this long if its result was never recorded
+        self.lease = lease
+        self.task = None
+        self.wakeup = None
+        self.stopping = False
+        self.sent = 0
+        self.retried = 0
+        self.dead = 0
+
+    def wake(self):
+        # Called after queueing, so new rows go out without waiting for the next poll
+        if self.wakeup:
+            self.wakeup.set()
+
+    def backoff(self, attempts):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1)
+
+    async def deliver(self, bot, row):
+        text = row.text
+        if row.action == 'invite':
+            # Bots can't add users to a channel; they can let them back in and hand them a link
+            await bot.unban_chat_member(chat_id=CHANNEL_ID, user_id=row.chat_id, only_if_banned=True)
+            link = await bot.create_chat_invite_link(chat_id=CHANNEL_ID, member_limit=1)
+            text = f"{text}\n\n🔗 Join the channel: {link.invite_link}"
+        await bot.send_message(chat_id=row.chat_id, text=text)
+
+    async def warn_admin(self, bot, rows, dead):
+        # The admin hears about users who were approved but never got their invite
+        errors = dict(dead)
+        for row in rows:
+            if row.action == 'invite' and row.id in errors:
+                try:
+                    await bot.send_message(chat_id=ADMIN_ID, text=f"⚠️ Could not send the channel invite to {row.chat_id}: {errors[row.id]}")
+                except Exception as e:
+                    print(f"Error warning admin about invite: {e}")
+
+    async def run_batch(self, bot):
+        # Returns how many rows were claimed
+        rows = await async_db.claim_outbox(datetime.now(), self.batch_size, self.lease)
+        if not rows:
+            return 0
+        sent, retries, dead = [], [], []
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def attempt(row):
+            async with semaphore:
+                try:
+                    await self.deliver(bot, row)
+                    sent.append(row.id)
+                    outbox_deliveries.inc((row.kind, 'sent'))
+                    return
+                except RetryAfter as e:
+                    delay = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                    retry, error = row.attempts < self.max_attempts, error_text(e)
+                except (Forbidden, BadRequest) as e:
+                    # Blocked the bot, deleted account, bad chat: retrying won't help
+                    delay, retry, error = 0, False, error_text(e)
+                except NetworkError as e:
+                    delay, retry, error = self.backoff(row.attempts), row.attempts < self.max_attempts, error_text(e)
+                except Exception as e:
+                    delay, retry, error = 0, False, error_text(e)
+                if retry:
+                    retries.append((row.id, datetime.now() + timedelta(seconds=delay), error))
+                    outbox_deliveries.inc((row.kind, 'retry'))
+                else:
+                    print(f"Outbox {row.kind} to {row.chat_id} dead-lettered after {row.attempts} attempt(s): {error}")
+                    dead.append((row.id, error))
+                    outbox_deliveries.inc((row.kind, 'dead'))
+
+        try:
+            await asyncio.gather(*(attempt(row) for row in rows))
+        finally:
+            # Also when cancelled part way, so what did go out isn't sent again after the lease
+            await async_db.finish_outbox(sent, retries, dead)
+            self.sent += len(sent)
+            self.retried += len(retries)
+            self.dead += len(dead)
+        if dead:
+            await self.warn_admin(bot, rows, dead)
+        return len(rows)
+
+    async def _loop(self, bot, purge_interval=3600):
+        next_purge = 0
+        while not self.stopping:
+            claimed = 0
+            try:
+                claimed = await self.run_batch(bot)
+                loop_time = asyncio.get_running_loop().time()
+                if loop_time >= next_purge:
+                    next_purge = loop_time + purge_interval
+                    await async_db.purge_outbox(datetime.now() - self.retention)
+            except Exception as e:
+                print(f"Outbox delivery error: {e}")
+            # A full batch means there may be more due right away
+            if claimed < self.batch_size and not self.stopping:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+
+    def start(self, bot):
+        self.stopping = False
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self._loop(bot))
+
+    async def stop(self, timeout=10):
+        # No new batch is claimed; the one in flight gets `timeout` seconds to finish and
+        # record its results. Whatever is left stays in the table for the next start.
+        if self.task:
+            self.stopping = True
+            self.wakeup.set()
+            try:
+                await asyncio.wait_for(self.task, timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+            self.task = None
+        self.wakeup = None
+
+    def get_stats(self):
+        return {'sent': self.sent, 'retried': self.retried, 'dead': self.dead}
+
+outbox_delivery = OutboxDelivery()
@@ -1,18 +1,19 @@
-import os
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update
 from telegram.ext import ContextTypes
-from database import db
+from database import async_db
+from proof_storage import store_user_proof
+from duplicates import duplicate_detector, describe
+from flood_control import flood_control
+from review_queue import review_queue, review_keyboard
+from config import STORE_PAYMENT_PROOFS
 from datetime import datetime
 
-UPLOADS_DIR = "uploads"
-os.makedirs(UPLOADS_DIR, exist_ok=True)
-
 async def handle_payment_screenshot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     message = update.message
     
     # Check if user is banned
-    db_user = db.get_user(user.id)
+    db_user = await async_db.get_user_status(user.id)
     if db_user and db_user.is_banned:
         await message.reply_text(
             "❌ Your account is currently banned due to expired subscription.\n\n"
@@ -23,17 +24,20 @@ async def handle_payment_screenshot(update: Update, context: ContextTypes.DEFAUL
     if message.photo:
         # Get the highest resolution photo
         photo = message.photo[-1]
-        file = await photo.get_file()
-        
-        # Save the file
-        filename = f"{user.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-        file_path = os.path.join(UPLOADS_DIR, filename)
-        await file.download_to_drive(file_path)
         
         # Store payment info in user context
-        context.user_data['payment_proof_path'] = file_path
+        context.user_data['proof_file_id'] = photo.file_id
+        context.user_data['proof_file_unique_id'] = photo.file_unique_id
+        context.user_data['payment_proof_path'] = ''
         context.user_data['payment_date'] = datetime.now()
         
+        # Save the file in the background
+        if STORE_PAYMENT_PROOFS:
+            context.application.create_task(
+                store_user_proof(photo, user.id, context.user_data, 'payment_proof_path'),
+                update=update
+            )
+        
         # Ask for full name
         await message.reply_text(
             "📝 Please type your full name exactly as it appears on the payment receipt:"
@@ -54,24 +58,31 @@ async def handle_full_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Get payment proof path from context
     proof_path = context.user_data.get('payment_proof_path', '')
     
+    # The next reviewer holds the submission until it's decided or the lease runs out
+    reviewer_id = review_queue.next_reviewer()
+    
     # Update or create user in database
-    db_user = db.get_user(user.id)
+    db_user = await async_db.get_user_status(user.id)
     if db_user:
-        db.update_user(user.id, {
+        await async_db.update_user(user.id, {
             'full_name': full_name,
             'payment_proof_path': proof_path,
+            'proof_file_id': context.user_data.get('proof_file_id'),
             'is_approved': False,
-            'is_banned': False
+            'is_banned': False,
+            **review_queue.claim(reviewer_id)
         })
     else:
-        db.add_user({
+        await async_db.add_user({
             'user_id': user.id,
             'username': user.username,
             'full_name': full_name,
             'phone_number': '',
             'is_approved': False,
             'is_banned': False,
-            'payment_proof_path': proof_path
+            'payment_proof_path': proof_path,
+            'proof_file_id': context.user_data.get('proof_file_id'),
+            **review_queue.claim(reviewer_id)
         })
     
     # Notify admin with approval buttons
@@ -82,21 +93,14 @@ async def handle_full_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"📛 Name: {full_name}\n"
             f"🆔 ID: {user.id}\n"
             f"📅 Submitted: {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+            f"{describe(await duplicate_detector.matches_for(user.id))}"
         )
         
-        keyboard = [
-            [
-                InlineKeyboardButton("✅ Approve", callback_data=f"approve_{user.id}"),
-                InlineKeyboardButton("❌ Reject", callback_data=f"reject_{user.id}")
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        # Send to admin
+        # Send to the reviewer
         await context.bot.send_message(
-            chat_id=context.bot_data['admin_id'],
+            chat_id=reviewer_id,
             text=admin_text,
-            reply_markup=reply_markup
+            reply_markup=review_keyboard(user.id)
         )
         
         # Confirm to user
@@ -116,5 +120,6 @@ async def handle_full_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Clear context
     context.user_data['awaiting_name'] = False
+    flood_control.proof_submitted(user.id)
     if 'payment_proof_path' in context.user_data:
         del context.user_data['payment_proof_path']
\ No newline at end of file
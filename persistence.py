@@ -0,0 +1,116 @@
+import asyncio
+import pickle
+from telegram.ext import BasePersistence, PersistenceInput
+from database import async_db
+from config import PERSISTENCE_INTERVAL
+
+class SQLPersistence(BasePersistence):
+    # Keeps user/chat/bot data in the bot's database, one pickled row per user or chat.
+    # Nothing per-user is read at startup: a user's data is loaded the first time one
+    # of their updates reaches a handler (refresh_user_data). Changed entries are
+    # buffered and written together in one transaction instead of re-dumping everything.
+    def __init__(self, update_interval=PERSISTENCE_INTERVAL, flush_delay=1.0):
+        super().__init__(
+            store_data=PersistenceInput(user_data=True, chat_data=True, bot_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.flush_delay = flush_delay
+        self.loaded = {'user': set(), 'chat': set()}
+        self.loading = {}
+        self.dirty = {}
+        self.flush_task = None
+        self.write_lock = asyncio.Lock()
+
+    async def _load_into(self, kind, key, target):
+        if key in self.loaded[kind]:
+            return
+        task = self.loading.get((kind, key))
+        if task:
+            # Another update from the same user/chat is already loading it
+            await task
+            return
+        task = asyncio.ensure_future(async_db.load_state(kind, key))
+        self.loading[(kind, key)] = task
+        try:
+            data = await task
+            if data:
+                for name, value in pickle.loads(data).items():
+                    target.setdefault(name, value)
+            self.loaded[kind].add(key)
+        finally:
+            self.loading.pop((kind, key), None)
+
+    def _mark(self, kind, key, data):
+        self.dirty[(kind, key)] = pickle.dumps(data) if data is not None else None
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        # Let the rest of this persistence round queue up, then write it in one go
+        await asyncio.sleep(self.flush_delay)
+        await asyncio.shield(self._write_dirty())
+
+    async def _write_dirty(self):
+        async with self.write_lock:
+            if not self.dirty:
+                return
+            batch, self.dirty = self.dirty, {}
+            if not await async_db.save_states(batch):
+                # Keep anything changed since, retry the rest next round
+                for key, data in batch.items():
+                    self.dirty.setdefault(key, data)
+                print(f"Persistence flush failed for {len(batch)} entries")
+
+    async def get_user_data(self):
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        data = await async_db.load_state('bot', 0)
+        return pickle.loads(data) if data else {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_user_data(self, user_id, data):
+        self._mark('user', user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._mark('chat', chat_id, data)
+
+    async def update_bot_data(self, data):
+        self._mark('bot', 0, data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        await self._load_into('user', user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        await self._load_into('chat', chat_id, chat_data)
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        self.loaded['user'].discard(user_id)
+        self._mark('user', user_id, None)
+
+    async def drop_chat_data(self, chat_id):
+        self.loaded['chat'].discard(chat_id)
+        self._mark('chat', chat_id, None)
+
+    async def flush(self):
+        # Called on shutdown; waits for a write already in progress
+        if self.flush_task and not self.flush_task.done():
+            self.flush_task.cancel()
+        await self._write_dirty()
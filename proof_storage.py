@@ -0,0 +1,149 @@
+import asyncio
+import hashlib
+import os
+import tarfile
+import tempfile
+import time
+import httpx
+from database import db, async_db
+from duplicates import duplicate_detector
+from config import PROOF_STORAGE_DIR, PROOF_RETENTION_DAYS
+
+CHUNK_SIZE = 64 * 1024
+
+class ProofStorage:
+    # Payment screenshots stored by content: the key is the SHA-256 of the bytes and
+    # the file lives at <root>/<key[:2]>/<key[2:4]>/<key>.jpg, so identical uploads
+    # share one file. Old proofs are packed into tar.gz archives by compact().
+    def __init__(self, root=PROOF_STORAGE_DIR):
+        self.root = root
+        self.tmp_dir = os.path.join(root, 'tmp')
+        self.archive_dir = os.path.join(root, 'archive')
+        self.client = None
+        self.compaction_task = None
+
+    def path_for(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], f"{key}.jpg")
+
+    async def save_telegram_file(self, file):
+        # Stream the download to a temp file, hashing chunks as they arrive
+        if self.client is None:
+            self.client = httpx.AsyncClient(timeout=60)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                async with self.client.stream('GET', file.file_path) as response:
+                    response.raise_for_status()
+                    async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                        digest.update(chunk)
+                        out.write(chunk)
+            return await self._store(tmp_path, digest.hexdigest())
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    async def _store(self, tmp_path, key):
+        # Never the sync db here: a blocking query on the loop stalls behind async writers
+        final_path = self.path_for(key)
+        if os.path.exists(final_path) or await async_db.get_proof_archive(key):
+            # Same bytes already stored
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(tmp_path, final_path)
+        return key
+
+    async def open_proof(self, key):
+        # Bytes of a stored proof, or None if it is gone. The archive lookup is async
+        # and file reads run in a thread, so this is safe to call from a handler.
+        archive = None
+        if not os.path.isfile(key) and not os.path.isfile(self.path_for(key)):
+            archive = await async_db.get_proof_archive(key)
+            if not archive:
+                return None
+        return await asyncio.to_thread(self._read_proof, key, archive)
+
+    def _read_proof(self, key, archive):
+        if archive:
+            with tarfile.open(os.path.join(self.archive_dir, archive), 'r:gz') as tar:
+                return tar.extractfile(key).read()
+        # Rows written before content addressing hold a plain file path
+        path = key if os.path.isfile(key) else self.path_for(key)
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def compact(self, older_than_days=PROOF_RETENTION_DAYS):
+        # Pack loose proofs older than the retention window into one compressed archive
+        cutoff = time.time() - older_than_days * 86400
+        old_files = []
+        for shard, dirs, files in os.walk(self.root):
+            dirs[:] = [d for d in dirs if d not in ('tmp', 'archive')]
+            for name in files:
+                path = os.path.join(shard, name)
+                if name.endswith('.jpg') and shard != self.root and os.path.getmtime(path) < cutoff:
+                    old_files.append((name[:-len('.jpg')], path))
+        if not old_files:
+            return 0
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        archive = f"proofs-{time.strftime('%Y%m%d-%H%M%S')}.tar.gz"
+        tmp_archive = os.path.join(self.archive_dir, f".{archive}")
+        with tarfile.open(tmp_archive, 'w:gz') as tar:
+            for key, path in old_files:
+                tar.add(path, arcname=key)
+        os.replace(tmp_archive, os.path.join(self.archive_dir, archive))
+
+        # Only drop the loose copies once the archive is recorded
+        if not db.record_proof_archive([key for key, _ in old_files], archive):
+            return 0
+        for _, path in old_files:
+            os.remove(path)
+        print(f"Archived {len(old_files)} payment proof(s) into {archive}")
+        return len(old_files)
+
+    async def _compaction_loop(self, interval):
+        while True:
+            try:
+                await asyncio.to_thread(self.compact)
+            except Exception as e:
+                print(f"Proof compaction error: {e}")
+            await asyncio.sleep(interval)
+
+    def start_compaction(self, interval=86400):
+        self.compaction_task = asyncio.create_task(self._compaction_loop(interval))
+
+    async def stop(self):
+        if self.compaction_task:
+            self.compaction_task.cancel()
+            self.compaction_task = None
+        if self.client:
+            await self.client.aclose()
+            self.client = None
+
+proof_storage = ProofStorage()
+
+async def store_user_proof(photo, user_id, user_data, data_key):
+    # Background copy of a submitted proof into local storage, then the duplicate
+    # check. The admin is sent the Telegram file_id, so nothing user-facing waits on this.
+    async with duplicate_detector.checking(photo.get_bot(), user_id) as check:
+        try:
+            file = await photo.get_file()
+            key = await proof_storage.save_telegram_file(file)
+        except Exception as e:
+            print(f"Error storing payment proof for {user_id}: {e}")
+            return None
+        
+        # Ignore if the user has sent a newer screenshot in the meantime
+        if user_data.get('proof_file_unique_id') != photo.file_unique_id:
+            return key
+        user_data[data_key] = key
+        # The submission may already have been saved without the key
+        await async_db.update_user(user_id, {'payment_proof_path': key})
+        check.matches = await duplicate_detector.check(user_id, key, proof_storage.path_for(key))
+        return key
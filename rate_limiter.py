@@ -0,0 +1,189 @@
+import asyncio
+import threading
+import time
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from config import ADMIN_IDS
+from metrics import registry, CallbackGauge
+
+class TokenBucket:
+    # Reservation style: each request takes a token now and waits off any debt
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now):
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def take(self, now):
+        # Non-waiting variant: a token if one is there, else False
+        self._refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def block(self, seconds, now):
+        # Nothing goes through this bucket for the next `seconds`
+        self._refill(now)
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+def posts_to_chat(endpoint):
+    # Calls that put a message in the chat, which is what Telegram limits per chat.
+    # Chat administration (bans, unbans, invite links) only counts toward the global rate.
+    return endpoint.startswith(('send', 'editMessage')) or endpoint in ('copyMessage', 'forwardMessage')
+
+class TokenBucketRateLimiter(BaseRateLimiter):
+    # Shared limiter for every outbound Telegram call that targets a chat.
+    # Messages pass the per-chat bucket, then (unless priority) the bulk bucket,
+    # then the global bucket. Bulk traffic is paced below the global rate, so
+    # priority messages (reviewer chats) always find free global capacity.
+    # Other calls on a chat only pass the global bucket.
+    def __init__(self, global_rate=30, priority_reserve=5, private_rate=1, private_burst=3,
+                 group_rate=20 / 60, group_burst=20, max_retries=3, priority_chat_ids=None):
+        self.global_rate = global_rate
+        self.priority_reserve = priority_reserve
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.bulk_bucket = TokenBucket(global_rate - priority_reserve, global_rate - priority_reserve)
+        self.private_rate = private_rate
+        self.private_burst = private_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self.priority_chat_ids = set(priority_chat_ids or [])
+        self.chat_buckets = {}
+        self.lock = threading.Lock()
+
+        # Counters for sizing
+        self.queue_depth = 0
+        self.peak_queue_depth = 0
+        self.requests = 0
+        self.delayed_requests = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.retry_after_hits = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def share(self, parts):
+        # Several processes sending as the same bot: each gets an equal slice of the global budget
+        global_rate = self.global_rate / parts
+        bulk_rate = (self.global_rate - self.priority_reserve) / parts
+        with self.lock:
+            self.global_bucket = TokenBucket(global_rate, max(global_rate, 1))
+            self.bulk_bucket = TokenBucket(bulk_rate, max(bulk_rate, 1))
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            # Drop idle buckets so the map doesn't grow with every chat ever seen
+            if len(self.chat_buckets) > 10000:
+                for key in [k for k, b in self.chat_buckets.items() if b.is_full(now)]:
+                    del self.chat_buckets[key]
+            if isinstance(chat_id, str) or chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.private_rate, self.private_burst)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _reserve(self, bucket):
+        with self.lock:
+            return bucket.reserve(time.monotonic())
+
+    async def _acquire(self, chat_id, priority, per_chat=True):
+        if per_chat:
+            with self.lock:
+                chat_bucket = self._chat_bucket(chat_id, time.monotonic())
+            buckets = [chat_bucket, self.global_bucket] if priority else [chat_bucket, self.bulk_bucket, self.global_bucket]
+        else:
+            buckets = [self.global_bucket]
+
+        waited = 0.0
+        for bucket in buckets:
+            delay = self._reserve(bucket)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                waited += delay
+        return waited
+
+    def _block(self, chat_id, seconds):
+        with self.lock:
+            now = time.monotonic()
+            self._chat_bucket(chat_id, now).block(seconds, now)
+            self.bulk_bucket.block(seconds, now)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        if chat_id is None:
+            return await callback(*args, **kwargs)
+        try:
+            chat_id = int(chat_id)
+        except (ValueError, TypeError):
+            pass
+
+        per_chat = posts_to_chat(endpoint)
+        priority = chat_id in self.priority_chat_ids or (
+            isinstance(rate_limit_args, dict) and rate_limit_args.get('priority', False)
+        )
+
+        self.requests += 1
+        self.queue_depth += 1
+        self.peak_queue_depth = max(self.peak_queue_depth, self.queue_depth)
+        try:
+            for attempt in range(self.max_retries + 1):
+                waited = await self._acquire(chat_id, priority, per_chat)
+                if waited:
+                    self.delayed_requests += 1
+                    self.total_wait += waited
+                    self.max_wait = max(self.max_wait, waited)
+                try:
+                    return await callback(*args, **kwargs)
+                except RetryAfter as e:
+                    self.retry_after_hits += 1
+                    if attempt == self.max_retries:
+                        raise
+                    retry_after = e.retry_after if isinstance(e.retry_after, (int, float)) else e.retry_after.total_seconds()
+                    print(f"Flood limit hit on {endpoint} for chat {chat_id}, retrying in {retry_after}s")
+                    self._block(chat_id, retry_after + 0.1)
+                    if not per_chat:
+                        # The retry doesn't pass the buckets just blocked
+                        await asyncio.sleep(retry_after + 0.1)
+        finally:
+            self.queue_depth -= 1
+
+    def get_stats(self):
+        return {
+            'queue_depth': self.queue_depth,
+            'peak_queue_depth': self.peak_queue_depth,
+            'requests': self.requests,
+            'delayed_requests': self.delayed_requests,
+            'avg_wait': self.total_wait / self.delayed_requests if self.delayed_requests else 0.0,
+            'max_wait': self.max_wait,
+            'retry_after_hits': self.retry_after_hits,
+        }
+
+# One limiter shared by the Application and the scheduler's bot
+rate_limiter = TokenBucketRateLimiter(priority_chat_ids=ADMIN_IDS)
+registry.register(CallbackGauge(
+    'bot_outbound_queue_depth', "Telegram calls waiting on the rate limiter", lambda: rate_limiter.queue_depth))
+registry.register(CallbackGauge(
+    'bot_outbound_delayed_total', "Telegram calls the rate limiter held back", lambda: rate_limiter.delayed_requests, 'counter'))
+registry.register(CallbackGauge(
+    'bot_flood_limit_hits_total', "RetryAfter responses from Telegram", lambda: rate_limiter.retry_after_hits, 'counter'))
@@ -0,0 +1,89 @@
+import asyncio
+import itertools
+from datetime import datetime, timedelta
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from database import async_db
+from config import ADMIN_IDS, REVIEW_LEASE_SECONDS
+
+def review_keyboard(user_id):
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("✅ Approve", callback_data=f"approve_{user_id}"),
+        InlineKeyboardButton("❌ Reject", callback_data=f"reject_{user_id}")
+    ]])
+
+async def send_for_review(bot, reviewer_id, user_id, caption, proof_file_id=None):
+    # The proof (or just its caption when there's no photo) and the decision buttons
+    try:
+        if not proof_file_id:
+            raise ValueError("no proof file id")
+        await bot.send_photo(chat_id=reviewer_id, photo=proof_file_id, caption=caption)
+    except Exception:
+        await bot.send_message(chat_id=reviewer_id, text=caption)
+    await bot.send_message(
+        chat_id=reviewer_id,
+        text="Approve or reject this payment:",
+        reply_markup=review_keyboard(user_id)
+    )
+
+class ReviewQueue:
+    # Submissions are dealt round-robin to the reviewers in ADMIN_IDS, and each is
+    # leased to its reviewer through users.claimed_by/claim_expires_at. Only the
+    # holder can decide it while the lease lasts (see AsyncDatabase.decide_claimed);
+    # once it runs out the submission goes to the next reviewer.
+    def __init__(self, reviewers=ADMIN_IDS, lease=REVIEW_LEASE_SECONDS):
+        self.reviewers = list(reviewers)
+        self.lease = lease
+        self.turn = itertools.count()
+        self.task = None
+        self.reassigned = 0
+
+    def is_reviewer(self, user_id):
+        return user_id in self.reviewers
+
+    def next_reviewer(self, exclude=None):
+        candidates = [reviewer for reviewer in self.reviewers if reviewer != exclude] or self.reviewers
+        return candidates[next(self.turn) % len(candidates)]
+
+    def claim(self, reviewer_id):
+        # Columns that hand a submission to reviewer_id, merged into the user update
+        return {'claimed_by': reviewer_id, 'claim_expires_at': datetime.now() + timedelta(seconds=self.lease)}
+
+    async def reassign_expired(self, bot):
+        moved = 0
+        for row in await async_db.get_expired_claims(datetime.now()):
+            reviewer_id = self.next_reviewer(exclude=row.claimed_by)
+            claim = self.claim(reviewer_id)
+            if not await async_db.move_claim(row.user_id, row.claimed_by, row.claim_expires_at,
+                                             reviewer_id, claim['claim_expires_at']):
+                continue
+            caption = (f"🔁 Reassigned (no decision from {row.claimed_by})\n"
+                       f"🆕 Payment from: @{row.username or 'No username'}\nName: {row.full_name}\nID: {row.user_id}")
+            try:
+                await send_for_review(bot, reviewer_id, row.user_id, caption, row.proof_file_id)
+            except Exception as e:
+                print(f"Error sending reassigned submission {row.user_id}: {e}")
+            moved += 1
+        self.reassigned += moved
+        return moved
+
+    async def _reassign_loop(self, bot, interval):
+        while True:
+            try:
+                moved = await self.reassign_expired(bot)
+                if moved:
+                    print(f"Reassigned {moved} submission(s) with expired leases")
+            except Exception as e:
+                print(f"Review reassignment error: {e}")
+            await asyncio.sleep(interval)
+
+    def start(self, bot, interval=60):
+        # With one reviewer there's no one to hand an expired lease to
+        if len(self.reviewers) > 1:
+            self.task = asyncio.create_task(self._reassign_loop(bot, interval))
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+review_queue = ReviewQueue()
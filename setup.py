@@ -8,8 +8,10 @@ setup(
         "python-telegram-bot==20.7",
         "python-dotenv==1.0.0", 
         "sqlalchemy==2.0.23",
-        "apscheduler==3.10.4",
-        "aiohttp==3.9.1"
+        "aiosqlite==0.19.0",
+        "asyncpg==0.29.0",
+        "aiohttp==3.9.1",
+        "Pillow==10.1.0"
     ],
     python_requires=">=3.10",
 )
\ No newline at end of file
@@ -0,0 +1,38 @@
+import asyncio
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import db, async_db
+from migrations import migrate
+from user_cache import user_cache
+
+def use_database(url):
+    # Point the module-level databases at url; they connect on first use
+    for database in (db, async_db):
+        database.database_url = url
+        database._engine = None
+        database._Session = None
+    user_cache.clear()
+
+@pytest.fixture
+def database(tmp_path):
+    use_database(f"sqlite:///{tmp_path / 'bot.db'}")
+    migrate()
+    yield db
+    db.engine.dispose()
+
+@pytest.fixture
+def run():
+    # Runs a coroutine on a fresh loop, closing the async engine's connections on the way out
+    def run(coroutine):
+        async def main():
+            try:
+                return await coroutine
+            finally:
+                if async_db._engine is not None:
+                    await async_db._engine.dispose()
+        return asyncio.run(main())
+    return run
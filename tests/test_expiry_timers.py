@@ -0,0 +1,67 @@
+import asyncio
+from datetime import datetime, timedelta
+import user_management
+from database import async_db
+from user_management import ExpiryTimers
+
+class Bot:
+    def __init__(self):
+        self.banned = []
+
+    async def ban_chat_member(self, chat_id, user_id):
+        self.banned.append(user_id)
+
+def count_sweeps(monkeypatch):
+    sweeps = []
+    check_subscriptions = user_management.check_subscriptions
+
+    async def counted(bot):
+        sweeps.append(datetime.now())
+        return await check_subscriptions(bot)
+
+    monkeypatch.setattr(user_management, 'check_subscriptions', counted)
+    return sweeps
+
+def test_armed_deadline_fires_once_and_disarmed_does_not(database, run, monkeypatch):
+    sweeps = count_sweeps(monkeypatch)
+
+    async def scenario():
+        timers = ExpiryTimers(horizon_hours=1, reminder_days=[])
+        await timers.start(Bot())
+        try:
+            timers.arm(5, datetime.now() + timedelta(seconds=0.3))
+            timers.disarm(5)
+            await asyncio.sleep(0.6)
+            disarmed = len(sweeps)
+            timers.arm(6, datetime.now() + timedelta(seconds=0.3))
+            await asyncio.sleep(0.8)
+            return disarmed, len(sweeps), timers.armed
+        finally:
+            await timers.stop()
+
+    disarmed, armed, left = run(scenario())
+    # One sweep at start; only the armed deadline adds another
+    assert disarmed == 1
+    assert armed == 2
+    assert left == {}
+
+def test_deadlines_past_the_horizon_are_loaded_as_it_moves(database, run):
+    bot = Bot()
+
+    async def scenario():
+        ends = datetime.now() + timedelta(seconds=1.5)
+        await async_db.add_user({'user_id': 7, 'username': 'user7', 'full_name': "Some One",
+                                 'is_approved': True, 'subscription_end': ends})
+        # A one-second lookahead: the deadline is beyond the first horizon
+        timers = ExpiryTimers(horizon_hours=1 / 3600, reminder_days=[])
+        await timers.start(bot)
+        try:
+            at_start = list(timers.heap)
+            await asyncio.sleep(2.5)
+            return at_start
+        finally:
+            await timers.stop()
+
+    at_start = run(scenario())
+    assert at_start == []
+    assert bot.banned == [7]
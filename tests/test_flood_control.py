@@ -0,0 +1,64 @@
+import pytest
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop
+from database import async_db
+from flood_control import FloodControl
+
+ADMIN = 999
+LIMITS = {'photo': 10, 'text': 3, 'command': 10, 'callback': 10}
+
+class Bot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+def message_update(bot, update_id, user_id, text=None, photo=False):
+    message = {'message_id': update_id, 'date': 0, 'chat': {'id': user_id, 'type': 'private'},
+               'from': {'id': user_id, 'is_bot': False, 'first_name': 'Someone'}}
+    if photo:
+        message['photo'] = [{'file_id': f"photo{update_id}", 'file_unique_id': f"u{update_id}", 'width': 90, 'height': 90}]
+    else:
+        message['text'] = text
+    return Update.de_json({'update_id': update_id, 'message': message}, bot)
+
+async def passes(flood, update):
+    try:
+        await flood.check(update, None)
+        return True
+    except ApplicationHandlerStop:
+        return False
+
+def test_messages_over_the_limit_are_dropped_with_one_notice(run):
+    bot = Bot()
+    flood = FloodControl(limits=LIMITS, exempt_ids=[ADMIN])
+
+    async def scenario():
+        users = [await passes(flood, message_update(bot, n, 7, "hi")) for n in range(5)]
+        admin = [await passes(flood, message_update(bot, 100 + n, ADMIN, "hi")) for n in range(5)]
+        return users, admin
+
+    users, admin = run(scenario())
+    assert users == [True, True, True, False, False]
+    assert admin == [True] * 5
+    assert len(bot.sent) == 1
+    assert flood.get_stats()['dropped_by_kind'] == {'text': 2}
+
+def test_second_proof_waits_for_the_review(database, run):
+    bot = Bot()
+    flood = FloodControl(limits=LIMITS, exempt_ids=[ADMIN])
+
+    async def scenario():
+        await async_db.add_user({'user_id': 7, 'username': 'user7', 'full_name': "Some One"})
+        results = [await passes(flood, message_update(bot, 1, 7, photo=True))]
+        flood.proof_submitted(7)
+        results.append(await passes(flood, message_update(bot, 2, 7, photo=True)))
+        # Rejected: a new proof is welcome again
+        await async_db.update_user(7, {'is_banned': True})
+        results.append(await passes(flood, message_update(bot, 3, 7, photo=True)))
+        return results
+
+    assert run(scenario()) == [True, False, True]
+    assert flood.get_stats()['debounced_proofs'] == 1
+    assert "under review" in bot.sent[0][1]
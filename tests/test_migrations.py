@@ -0,0 +1,49 @@
+import sqlite3
+from sqlalchemy import inspect
+from conftest import use_database
+from database import db
+from migrations import migrate, current_version, MIGRATIONS
+
+# users as the bot created it before migrations existed
+BASELINE_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER NOT NULL PRIMARY KEY,
+    user_id INTEGER UNIQUE,
+    username VARCHAR,
+    full_name VARCHAR,
+    subscription_end DATETIME,
+    is_approved BOOLEAN,
+    is_banned BOOLEAN,
+    payment_proof_path VARCHAR,
+    created_at DATETIME
+);
+INSERT INTO users (user_id, username, full_name, is_approved, is_banned, payment_proof_path, created_at)
+VALUES (42, 'someone', 'Some One', 0, 0, '', '2024-01-01 00:00:00');
+"""
+
+def test_baseline_database_upgrades_to_latest(tmp_path):
+    path = tmp_path / 'baseline.db'
+    with sqlite3.connect(path) as connection:
+        connection.executescript(BASELINE_SCHEMA)
+    use_database(f"sqlite:///{path}")
+    try:
+        applied = migrate()
+        assert applied == [version for version, _, _ in MIGRATIONS]
+        assert current_version(db.engine) == MIGRATIONS[-1][0]
+
+        inspector = inspect(db.engine)
+        columns = {column['name'] for column in inspector.get_columns('users')}
+        assert {'phone_number', 'proof_file_id', 'claimed_by', 'claim_expires_at'} <= columns
+        indexes = {index['name'] for index in inspector.get_indexes('users')}
+        assert {'ix_users_status', 'ix_users_review_queue', 'ix_users_subscription_end', 'ix_users_claim_expires'} <= indexes
+        assert {'media_files', 'proof_hashes', 'outbox'} <= set(inspector.get_table_names())
+        assert db.get_user(42).username == 'someone'
+
+        # Nothing left to do the second time
+        assert migrate() == []
+    finally:
+        db.engine.dispose()
+
+def test_fresh_database_migrates(database):
+    assert current_version(database.engine) == MIGRATIONS[-1][0]
+    assert 'ix_users_claim_expires' in {index['name'] for index in inspect(database.engine).get_indexes('users')}
@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+from telegram.error import Forbidden, TimedOut
+from database import db, async_db, OutboxMessage
+from outbox import OutboxDelivery, notify
+from config import OUTBOX_MAX_ATTEMPTS
+
+class Bot:
+    # Fails sends to the chats in `failures` with the given error
+    def __init__(self, failures=None):
+        self.failures = failures or {}
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        if chat_id in self.failures:
+            raise self.failures[chat_id]
+        self.sent.append(chat_id)
+
+def outbox_rows():
+    with db.Session() as session:
+        return {row.chat_id: row for row in session.query(OutboxMessage)}
+
+def test_sent_rows_are_marked_and_not_claimed_again(database, run):
+    bot = Bot()
+
+    async def scenario():
+        await async_db.enqueue([notify(1, "hello"), notify(2, "hello")])
+        delivery = OutboxDelivery()
+        return await delivery.run_batch(bot), await delivery.run_batch(bot)
+
+    assert run(scenario()) == (2, 0)
+    assert sorted(bot.sent) == [1, 2]
+    assert {row.status for row in outbox_rows().values()} == {'sent'}
+
+def test_network_errors_back_off(database, run):
+    bot = Bot({1: TimedOut()})
+
+    async def scenario():
+        await async_db.enqueue([notify(1, "hello")])
+        delivery = OutboxDelivery(base_delay=60)
+        started = datetime.now()
+        await delivery.run_batch(bot)
+        # Not due again until the backoff passes
+        return started, await delivery.run_batch(bot)
+
+    started, claimed = run(scenario())
+    row = outbox_rows()[1]
+    assert claimed == 0
+    assert row.status == 'pending' and row.attempts == 1 and 'TimedOut' in row.last_error
+    assert started + timedelta(seconds=29) <= row.next_attempt_at <= datetime.now() + timedelta(seconds=60)
+
+def test_dead_lettered_after_max_attempts(database, run):
+    bot = Bot({1: TimedOut()})
+
+    async def scenario():
+        await async_db.enqueue([notify(1, "hello")])
+        delivery = OutboxDelivery(base_delay=0)
+        for _ in range(OUTBOX_MAX_ATTEMPTS + 1):
+            await delivery.run_batch(bot)
+        return delivery.get_stats(), await async_db.get_outbox_stats()
+
+    stats, counts = run(scenario())
+    row = outbox_rows()[1]
+    assert row.status == 'dead' and row.attempts == OUTBOX_MAX_ATTEMPTS
+    assert stats == {'sent': 0, 'retried': OUTBOX_MAX_ATTEMPTS - 1, 'dead': 1}
+    assert counts['dead'] == 1 and counts['pending'] == 0
+
+def test_permanent_errors_are_dead_lettered_at_once(database, run):
+    bot = Bot({1: Forbidden("bot was blocked by the user")})
+
+    async def scenario():
+        await async_db.enqueue([notify(1, "hello"), notify(2, "hello")])
+        await OutboxDelivery().run_batch(bot)
+
+    run(scenario())
+    rows = outbox_rows()
+    assert rows[1].status == 'dead' and rows[1].attempts == 1
+    assert rows[2].status == 'sent'
+
+def test_unfinished_claims_are_reclaimed_after_the_lease(database, run):
+    async def scenario():
+        await async_db.enqueue([notify(1, "hello")])
+        now = datetime.now()
+        first = await async_db.claim_outbox(now, 10, lease=60)
+        # Claimed and never finished, as if the process died mid-send
+        during = await async_db.claim_outbox(now + timedelta(seconds=30), 10, lease=60)
+        after = await async_db.claim_outbox(now + timedelta(seconds=61), 10, lease=60)
+        return first, during, after
+
+    first, during, after = run(scenario())
+    assert [row.chat_id for row in first] == [1]
+    assert during == []
+    assert [(row.chat_id, row.attempts) for row in after] == [(1, 2)]
@@ -0,0 +1,63 @@
+import pickle
+from database import async_db
+from persistence import SQLPersistence
+
+def test_state_is_read_back_lazily_by_a_new_instance(database, run):
+    async def scenario():
+        writer = SQLPersistence(flush_delay=0)
+        await writer.update_user_data(7, {'awaiting_name': True, 'step': 2})
+        await writer.update_chat_data(-100, {'topic': 'payments'})
+        await writer.update_bot_data({'admin_id': 1})
+        await writer.flush()
+
+        reader = SQLPersistence()
+        # Nothing per user is read at startup
+        assert await reader.get_user_data() == {}
+        assert await reader.get_bot_data() == {'admin_id': 1}
+        user_data = {'step': 3}
+        await reader.refresh_user_data(7, user_data)
+        chat_data = {}
+        await reader.refresh_chat_data(-100, chat_data)
+
+        # Loaded once: later changes in the database aren't pulled in again
+        await writer.update_user_data(7, {'awaiting_name': False})
+        await writer.flush()
+        again = {}
+        await reader.refresh_user_data(7, again)
+        return user_data, chat_data, again
+
+    user_data, chat_data, again = run(scenario())
+    # What the handler already set wins over the stored copy
+    assert user_data == {'awaiting_name': True, 'step': 3}
+    assert chat_data == {'topic': 'payments'}
+    assert again == {}
+
+def test_failed_flush_is_retried_with_the_latest_data(database, run, monkeypatch):
+    writes = []
+    save_states = async_db.save_states
+
+    async def failing_once(states):
+        writes.append(sorted(states))
+        if len(writes) == 1:
+            return False
+        return await save_states(states)
+
+    monkeypatch.setattr(async_db, 'save_states', failing_once)
+
+    async def scenario():
+        persistence = SQLPersistence(flush_delay=0)
+        await persistence.update_user_data(7, {'step': 1})
+        await persistence.update_user_data(8, {'step': 1})
+        await persistence.flush()
+        # Changed while the failed batch waits for its retry
+        await persistence.update_user_data(7, {'step': 2})
+        await persistence.flush()
+        await persistence.drop_user_data(8)
+        await persistence.flush()
+        return await async_db.load_state('user', 7), await async_db.load_state('user', 8)
+
+    user_7, user_8 = run(scenario())
+    # Both users went out in one write each time
+    assert writes[:2] == [[('user', 7), ('user', 8)], [('user', 7), ('user', 8)]]
+    assert pickle.loads(user_7) == {'step': 2}
+    assert user_8 is None
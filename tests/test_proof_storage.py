@@ -0,0 +1,21 @@
+import os
+from proof_storage import ProofStorage
+
+def store(storage, key, data):
+    path = storage.path_for(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def test_open_proof_reads_loose_and_archived_proofs(database, run, tmp_path):
+    storage = ProofStorage(str(tmp_path / 'proofs'))
+    store(storage, 'aa' * 32, b'old receipt')
+    # Everything is older than a negative retention window
+    assert storage.compact(older_than_days=-1) == 1
+    assert not os.path.exists(storage.path_for('aa' * 32))
+    store(storage, 'bb' * 32, b'new receipt')
+
+    async def scenario():
+        return [await storage.open_proof(key) for key in ('aa' * 32, 'bb' * 32, 'cc' * 32)]
+
+    assert run(scenario()) == [b'old receipt', b'new receipt', None]
@@ -0,0 +1,26 @@
+from rate_limiter import TokenBucketRateLimiter, posts_to_chat
+
+CHANNEL = -1001234567890
+
+def test_only_messages_use_the_per_chat_bucket():
+    assert posts_to_chat('sendMessage')
+    assert posts_to_chat('editMessageText')
+    assert posts_to_chat('copyMessage')
+    assert not posts_to_chat('banChatMember')
+    assert not posts_to_chat('unbanChatMember')
+    assert not posts_to_chat('createChatInviteLink')
+
+def test_channel_bans_are_not_paced_as_group_messages(run):
+    limiter = TokenBucketRateLimiter()
+
+    async def callback():
+        return True
+
+    async def ban_wave():
+        for user_id in range(60):
+            await limiter.process_request(callback, (), {}, 'banChatMember', {'chat_id': CHANNEL, 'user_id': user_id}, None)
+
+    run(ban_wave())
+    # 60 bans fit in a couple of seconds of global budget; the group bucket would have held them for minutes
+    assert CHANNEL not in limiter.chat_buckets
+    assert limiter.max_wait < 2
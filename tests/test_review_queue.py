@@ -0,0 +1,92 @@
+import asyncio
+from datetime import datetime, timedelta
+from database import db, async_db, OutboxMessage
+from duplicates import DuplicateDetector
+from outbox import notify
+from config import ADMIN_ID
+
+REVIEWER = 1001
+OTHER_REVIEWER = 1002
+APPROVE = {'is_approved': True, 'is_banned': False}
+
+async def submit(user_id, reviewer_id=None, lease=timedelta(minutes=15)):
+    await async_db.add_user({'user_id': user_id, 'username': f"user{user_id}", 'full_name': "Some One"})
+    if reviewer_id:
+        await async_db.update_user(user_id, {'claimed_by': reviewer_id, 'claim_expires_at': datetime.now() + lease})
+
+class Bot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        self.sent.append((chat_id, text))
+
+def test_duplicate_warning_goes_to_the_claim_holder(database, run):
+    bot = Bot()
+
+    async def scenario():
+        await submit(7, REVIEWER)
+        await submit(8, REVIEWER, lease=timedelta(minutes=-1))
+        await submit(9)
+        detector = DuplicateDetector()
+        for user_id in (7, 8, 9):
+            await detector.warn_admin(bot, user_id, [(3, 42)])
+
+    run(scenario())
+    assert [chat_id for chat_id, _ in bot.sent] == [REVIEWER, ADMIN_ID, ADMIN_ID]
+
+def outbox_rows():
+    with db.Session() as session:
+        return [(row.chat_id, row.kind) for row in session.query(OutboxMessage).order_by(OutboxMessage.id)]
+
+def test_only_the_claim_holder_decides_while_the_lease_lasts(database, run):
+    async def scenario():
+        await submit(7, REVIEWER)
+        results = [
+            await async_db.decide_claimed(7, OTHER_REVIEWER, APPROVE),
+            await async_db.decide_claimed(7, REVIEWER, APPROVE),
+            # A second tap, by either reviewer
+            await async_db.decide_claimed(7, REVIEWER, APPROVE),
+            await async_db.decide_claimed(7, OTHER_REVIEWER, APPROVE),
+        ]
+        return results, await async_db.get_user(7)
+
+    results, user = run(scenario())
+    assert [result and result.user_id for result in results] == [None, 7, None, None]
+    assert user.is_approved and user.claimed_by is None and user.claim_expires_at is None
+
+def test_anyone_may_decide_once_the_lease_runs_out(database, run):
+    async def scenario():
+        await submit(7, REVIEWER)
+        later = datetime.now() + timedelta(minutes=16)
+        return await async_db.decide_claimed(7, OTHER_REVIEWER, APPROVE, now=later)
+
+    assert run(scenario()).user_id == 7
+
+def test_second_reviewer_loses_the_race(database, run):
+    async def scenario():
+        await submit(7, REVIEWER, lease=timedelta(minutes=-1))
+        return await asyncio.gather(*(
+            async_db.decide_claimed(7, reviewer_id, APPROVE, outbox=[notify(7, f"from {reviewer_id}", 'approved')])
+            for reviewer_id in (REVIEWER, OTHER_REVIEWER)
+        ))
+
+    results = run(scenario())
+    assert len([result for result in results if result]) == 1
+    # Only the winner's notice was queued
+    assert outbox_rows() == [(7, 'approved')]
+
+def test_repeated_pending_decision_is_a_no_op(database, run):
+    async def scenario():
+        await submit(7)
+        await submit(8, REVIEWER)
+        outbox_for = lambda user_id: [notify(user_id, "approved", 'approved')]
+        first = await async_db.decide_pending([7, 8], APPROVE, outbox_for=outbox_for)
+        second = await async_db.decide_pending([7, 8], {'is_approved': False, 'is_banned': True}, outbox_for=outbox_for)
+        return first, second, await async_db.get_user(7)
+
+    first, second, user = run(scenario())
+    assert sorted(user_id for user_id, _ in first) == [7, 8]
+    assert second == []
+    assert user.is_approved and not user.is_banned
+    assert outbox_rows() == [(7, 'approved'), (8, 'approved')]
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+import user_management
+from database import db, async_db, OutboxMessage
+from user_management import check_subscriptions
+
+class Bot:
+    # Bans fail for the users in `failing`
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.banned = []
+
+    async def ban_chat_member(self, chat_id, user_id):
+        if user_id in self.failing:
+            raise RuntimeError("ban failed")
+        self.banned.append(user_id)
+
+async def subscriber(user_id, ends_in):
+    await async_db.add_user({'user_id': user_id, 'username': f"user{user_id}", 'full_name': "Some One",
+                             'is_approved': True, 'subscription_end': datetime.now() + ends_in})
+
+def queued():
+    with db.Session() as session:
+        return sorted((row.chat_id, row.kind) for row in session.query(OutboxMessage))
+
+def test_expired_users_are_banned_once(database, run):
+    bot = Bot()
+
+    async def scenario():
+        await subscriber(1, timedelta(hours=-2))
+        await subscriber(2, timedelta(hours=-1))
+        await subscriber(3, timedelta(days=10))
+        await check_subscriptions(bot)
+        await check_subscriptions(bot)
+        return await async_db.get_user(1), await async_db.get_watermark('expired')
+
+    user, watermark = run(scenario())
+    assert sorted(bot.banned) == [1, 2]
+    assert user.is_banned and not user.is_approved
+    assert queued() == [(1, 'expired'), (2, 'expired')]
+    assert watermark > datetime.now() - timedelta(minutes=1)
+
+def test_failed_ban_holds_the_watermark_back_for_a_retry(database, run):
+    async def scenario():
+        await subscriber(1, timedelta(hours=-2))
+        await subscriber(2, timedelta(hours=-1))
+        await check_subscriptions(Bot(failing={1}))
+        held = await async_db.get_watermark('expired')
+        retry = Bot()
+        await check_subscriptions(retry)
+        return held, (await async_db.get_user(1)).subscription_end, retry.banned
+
+    held, first_end, retried = run(scenario())
+    assert held < first_end
+    assert retried == [1]
+    assert queued() == [(1, 'expired'), (2, 'expired')]
+
+def test_each_user_gets_the_closest_reminder_once(database, run, monkeypatch):
+    monkeypatch.setattr(user_management, 'REMINDER_DAYS', [1, 3])
+
+    async def scenario():
+        await subscriber(1, timedelta(hours=12))
+        await subscriber(2, timedelta(days=2))
+        await subscriber(3, timedelta(days=5))
+        await check_subscriptions(Bot())
+        await check_subscriptions(Bot())
+
+    run(scenario())
+    assert queued() == [(1, 'warning_1d'), (2, 'warning_3d')]
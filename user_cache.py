@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from config import USER_CACHE_ENABLED, USER_CACHE_SIZE, USER_CACHE_TTL
+from metrics import registry, CallbackGauge
+
+# The fields hot-path handlers actually look at
+UserStatus = namedtuple('UserStatus', ['user_id', 'is_approved', 'is_banned', 'subscription_end'])
+
+def status_of(user):
+    return UserStatus(user.user_id, user.is_approved, user.is_banned, user.subscription_end)
+
+class UserStatusCache:
+    # LRU + TTL cache of UserStatus records keyed by user_id. The database layer
+    # writes through it on add/update, so entries only go stale when another
+    # process writes the same row, and then for at most `ttl` seconds.
+    def __init__(self, max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL, enabled=USER_CACHE_ENABLED):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.enabled = enabled
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Called with user_ids whose rows this process changed (worker processes fan these out)
+        self.listeners = []
+
+    def get(self, user_id):
+        if not self.enabled:
+            return None
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[user_id]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, status):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.entries[status.user_id] = (time.monotonic() + self.ttl, status)
+            self.entries.move_to_end(status.user_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_ids, publish=True):
+        with self.lock:
+            for user_id in user_ids:
+                self.entries.pop(user_id, None)
+        if publish:
+            self.publish(user_ids)
+
+    def publish(self, user_ids):
+        for listener in self.listeners:
+            listener(user_ids)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        # For tests: every lookup goes to the database
+        self.enabled = False
+        self.clear()
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+user_cache = UserStatusCache()
+registry.register(CallbackGauge('bot_user_cache_hits_total', "User status cache hits", lambda: user_cache.hits, 'counter'))
+registry.register(CallbackGauge('bot_user_cache_misses_total', "User status cache misses", lambda: user_cache.misses, 'counter'))
+registry.register(CallbackGauge('bot_user_cache_size', "Entries in the user status cache", lambda: len(user_cache.entries)))
@@ -1,64 +1,245 @@
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
 from datetime import datetime, timedelta
-from database import db
+from database import async_db
 import asyncio
-from telegram import Bot
-from config import BOT_TOKEN, CHANNEL_ID
+import heapq
+import time
+from metrics import sweep_seconds, sweep_users
+from outbox import outbox_delivery, notify
+from config import CHANNEL_ID, SWEEP_BATCH_SIZE, SWEEP_CONCURRENCY, TIMER_HORIZON_HOURS, REMINDER_DAYS
 
-bot_instance = Bot(token=BOT_TOKEN)
+EXPIRED_TEXT = (
+    "❌ Your subscription has expired. You've been removed from the premium channel.\n\n"
+    "To regain access, you must make a new payment and go through the approval process again."
+)
 
-async def check_subscriptions():
-    users = db.get_all_users()
-    now = datetime.now()
+def warning_text(days):
+    period = "24 hours" if days == 1 else f"{days} days"
+    return (
+        f"⚠️ Your subscription expires in {period}!\n\n"
+        "After expiration, you will be automatically banned and must complete a new payment "
+        "and approval process to regain access."
+    )
+
+async def expire_users(bot, users, concurrency=SWEEP_CONCURRENCY):
+    # Ban, save and notify a batch of expired users; returns one result per user.
+    # The notice is queued with the ban's database update and sent by the outbox.
+    semaphore = asyncio.Semaphore(concurrency)
+    results = {
+        user.user_id: {
+            'user_id': user.user_id,
+            'subscription_end': user.subscription_end,
+            'banned': False,
+            'saved': False,
+            'notified': False,
+            'error': None
+        }
+        for user in users
+    }
     
-    for user in users:
-        # Check if subscription expired
-        if user.is_approved and user.subscription_end and now >= user.subscription_end:
-            # BAN THE USER (no automatic continuation)
+    async def ban(user_id):
+        async with semaphore:
             try:
-                # Remove from channel
-                await bot_instance.ban_chat_member(
-                    chat_id=CHANNEL_ID,
-                    user_id=user.user_id
-                )
-                
-                # Update database - mark as banned and not approved
-                db.update_user(user.user_id, {
-                    'is_approved': False,
-                    'is_banned': True
-                })
-                
-                # Notify user
-                await bot_instance.send_message(
-                    chat_id=user.user_id,
-                    text="❌ Your subscription has expired. You've been removed from the premium channel.\n\n"
-                         "To regain access, you must make a new payment and go through the approval process again."
-                )
-                print(f"Banned expired user: {user.user_id}")
-                
+                await bot.ban_chat_member(chat_id=CHANNEL_ID, user_id=user_id)
+                results[user_id]['banned'] = True
             except Exception as e:
-                print(f"Error banning user {user.user_id}: {e}")
-        
-        # Warning 1 day before expiry
-        elif user.is_approved and user.subscription_end:
-            if user.subscription_end - timedelta(days=1) <= now < user.subscription_end:
+                results[user_id]['error'] = f"ban failed: {e}"
+    
+    # Remove from channel
+    await asyncio.gather(*(ban(user_id) for user_id in results))
+    
+    # Mark the removed users as banned and not approved, and queue their notices, in a single transaction
+    banned_ids = [user_id for user_id, result in results.items() if result['banned']]
+    if banned_ids:
+        notices = [notify(user_id, EXPIRED_TEXT, 'expired') for user_id in banned_ids]
+        if await async_db.bulk_update_users(banned_ids, {'is_approved': False, 'is_banned': True}, outbox=notices):
+            for user_id in banned_ids:
+                results[user_id]['saved'] = results[user_id]['notified'] = True
+            outbox_delivery.wake()
+        else:
+            for user_id in banned_ids:
+                results[user_id]['error'] = "database update failed"
+    
+    await async_db.record_notifications([
+        {'user_id': user_id, 'kind': 'expired', 'period_end': results[user_id]['subscription_end']}
+        for user_id in banned_ids if results[user_id]['notified']
+    ])
+    
+    return list(results.values())
+
+async def warn_users(users, days):
+    # Queue reminders with their ledger rows; users already reminded this period are skipped
+    kind = f'warning_{days}d'
+    text = warning_text(days)
+    queued = await async_db.enqueue(
+        [notify(user.user_id, text, kind) for user in users],
+        [{'user_id': user.user_id, 'kind': kind, 'period_end': user.subscription_end} for user in users]
+    )
+    if queued:
+        outbox_delivery.wake()
+    return [
+        {'user_id': user.user_id, 'subscription_end': user.subscription_end, 'notified': queued,
+         'error': None if queued else "queueing failed"}
+        for user in users
+    ]
+
+async def check_subscriptions(bot):
+    started = time.perf_counter()
+    now = datetime.now()
+    results = []
+    
+    # Only subscriptions that ran out since the last sweep (no automatic continuation)
+    expired_since = await async_db.get_watermark('expired')
+    failed_ends = []
+    async for batch in async_db.iter_expired_users(now, since=expired_since, batch_size=SWEEP_BATCH_SIZE):
+        for result in await expire_users(bot, batch):
+            if not result['saved']:
+                print(f"Error banning user {result['user_id']}: {result['error']}")
+                failed_ends.append(result['subscription_end'])
+            results.append(result)
+    
+    # Keep failed users inside the next window so they are retried
+    if failed_ends:
+        await async_db.set_watermark('expired', min(failed_ends) - timedelta(microseconds=1))
+    else:
+        await async_db.set_watermark('expired', now)
+    
+    # Reminders before expiry. Each tier covers subscriptions ending between the next
+    # smaller tier and itself, so a user only gets the closest reminder that applies,
+    # and the ledger makes sure each one goes out once per subscription period.
+    lower = timedelta(0)
+    for days in REMINDER_DAYS:
+        kind = f'warning_{days}d'
+        start = now + lower
+        end = now + timedelta(days=days)
+        since = await async_db.get_watermark(kind)
+        if since and since > start:
+            start = since
+        failed_warnings = []
+        async for batch in async_db.iter_users_expiring_between(start, end, SWEEP_BATCH_SIZE, unnotified=kind):
+            warned = await warn_users(batch, days)
+            for result in warned:
+                if result['error']:
+                    print(f"Error queueing warning for user {result['user_id']}: {result['error']}")
+                    failed_warnings.append(result['subscription_end'])
+            sweep_users.inc((kind,), len([result for result in warned if not result['error']]))
+        await async_db.set_watermark(kind, min(failed_warnings) - timedelta(microseconds=1) if failed_warnings else end)
+        lower = timedelta(days=days)
+    
+    failed = len([result for result in results if not result['saved']])
+    sweep_users.inc(('expired',), len(results) - failed)
+    sweep_users.inc(('expire_failed',), failed)
+    sweep_seconds.observe((), time.perf_counter() - started)
+    print(f"Subscription check: banned {len(results) - failed} expired user(s), {failed} failed")
+    return results
+
+class ExpiryTimers:
+    # Per-user deadlines (reminders and expiry) kept in a heap on the bot's own loop.
+    # Only deadlines up to `horizon` live in memory; later ones stay in the database and
+    # are pulled in through the subscription_end index as the horizon moves forward.
+    # A firing deadline runs the incremental sweep, which picks up exactly the users
+    # due since the last run, so simultaneous expirations are handled as one batch.
+    RETRY_DELAY = timedelta(minutes=5)
+    
+    def __init__(self, horizon_hours=TIMER_HORIZON_HOURS, reminder_days=REMINDER_DAYS):
+        self.lookahead = timedelta(hours=horizon_hours)
+        # How long before subscription_end each deadline fires
+        self.offsets = [timedelta(0)] + [timedelta(days=days) for days in reminder_days]
+        self.heap = []
+        self.armed = {}
+        self.horizon = None
+        self.retry_at = None
+        self.bot = None
+        self.task = None
+        self.wakeup = None
+    
+    def _push(self, when, user_id, subscription_end):
+        if self.horizon is None or when > self.horizon:
+            # Loaded from the database once the horizon reaches it
+            return
+        heapq.heappush(self.heap, (when, user_id, subscription_end))
+        if self.wakeup and self.heap[0][0] == when:
+            self.wakeup.set()
+    
+    def arm(self, user_id, subscription_end):
+        self.armed[user_id] = subscription_end
+        for offset in self.offsets:
+            self._push(subscription_end - offset, user_id, subscription_end)
+    
+    def disarm(self, user_id):
+        # Heap entries are dropped lazily when they come up
+        self.armed.pop(user_id, None)
+    
+    async def _extend_horizon(self, now):
+        start = self.horizon or now
+        end = now + self.lookahead
+        # Deadlines falling in (start, end] for every offset
+        loaded = []
+        for offset in self.offsets:
+            loaded.append((offset, await async_db.get_subscription_ends(start + offset, end + offset)))
+        self.horizon = end
+        for offset, rows in loaded:
+            for user_id, subscription_end in rows:
+                self.armed[user_id] = subscription_end
+                self._push(subscription_end - offset, user_id, subscription_end)
+    
+    async def start(self, bot):
+        self.bot = bot
+        self.wakeup = asyncio.Event()
+        # Catch up on anything that came due while the bot was down, then load the timers
+        await check_subscriptions(bot)
+        await self._extend_horizon(datetime.now())
+        self.task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+    
+    async def _run(self):
+        while True:
+            now = datetime.now()
+            if now + self.lookahead / 2 >= self.horizon:
+                await self._extend_horizon(now)
+            
+            due = self.retry_at is not None and self.retry_at <= now
+            if due:
+                self.retry_at = None
+            while self.heap and self.heap[0][0] <= now:
+                when, user_id, subscription_end = heapq.heappop(self.heap)
+                if self.armed.get(user_id) == subscription_end:
+                    due = True
+                    if when == subscription_end:
+                        del self.armed[user_id]
+            
+            if due:
                 try:
-                    await bot_instance.send_message(
-                        chat_id=user.user_id,
-                        text="⚠️ Your subscription expires in 24 hours!\n\n"
-                             "After expiration, you will be automatically banned and must complete a new payment "
-                             "and approval process to regain access."
-                    )
+                    results = await check_subscriptions(self.bot)
+                    if any(not result['saved'] for result in results):
+                        self.retry_at = datetime.now() + self.RETRY_DELAY
                 except Exception as e:
-                    print(f"Error sending warning to user {user.user_id}: {e}")
+                    print(f"Subscription timer error: {e}")
+            
+            # Sleep until the next deadline, the next horizon refill, or a newly armed earlier timer
+            wake_at = now + self.lookahead / 2
+            if self.heap:
+                wake_at = min(wake_at, self.heap[0][0])
+            if self.retry_at:
+                wake_at = min(wake_at, self.retry_at)
+            delay = max((wake_at - datetime.now()).total_seconds(), 0)
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
 
-def start_scheduler():
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(
-        lambda: asyncio.run(check_subscriptions()),
-        trigger=IntervalTrigger(hours=1),
-        id='subscription_check',
-        replace_existing=True
-    )
-    scheduler.start()
\ No newline at end of file
+expiry_timers = ExpiryTimers()
+
+async def start_scheduler(application):
+    await expiry_timers.start(application.bot)
+
+async def stop_scheduler(application):
+    await expiry_timers.stop()
@@ -0,0 +1,96 @@
+import asyncio
+import hmac
+import secrets
+import signal
+from aiohttp import web
+from telegram import Update
+from config import WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_MAX_PENDING
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+class WebhookServer:
+    # Embedded aiohttp endpoint that feeds updates straight into the Application.
+    # Once max_pending updates are in flight it answers 503, and Telegram redelivers
+    # later, so a burst cannot pile up unbounded work in memory.
+    def __init__(self, application, listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT, path=WEBHOOK_PATH,
+                 secret_token=WEBHOOK_SECRET, max_pending=WEBHOOK_MAX_PENDING):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token or secrets.token_urlsafe(32)
+        self.max_pending = max_pending
+        self.pending = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.runner = None
+
+    async def handle_update(self, request):
+        token = request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(token.encode(), self.secret_token.encode()):
+            return web.Response(status=403)
+
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            return web.Response(status=503, headers={'Retry-After': '1'})
+
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        update = Update.de_json(data, self.application.bot)
+        self.pending += 1
+        self.accepted += 1
+        self.application.create_task(self._process(update), update=update)
+        return web.Response()
+
+    async def _process(self, update):
+        try:
+            await self.application.update_processor.process_update(
+                update, self.application.process_update(update)
+            )
+        finally:
+            self.pending -= 1
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.listen, self.port).start()
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+async def run_webhook(application):
+    server = WebhookServer(application)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        # Without a public URL the webhook is assumed to be registered elsewhere (or not at all, for local runs)
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+                secret_token=server.secret_token,
+                allowed_updates=Update.ALL_TYPES
+            )
+        await application.start()
+        await server.start()
+        print(f"🌐 Webhook listening on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+        await stop.wait()
+
+        await server.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        if application.post_shutdown:
+            await application.post_shutdown(application)
@@ -0,0 +1,201 @@
+import asyncio
+import multiprocessing
+import queue
+import signal
+import time
+from telegram import Bot, Update
+from telegram.ext import BaseUpdateProcessor
+from config import BOT_TOKEN, ADMIN_IDS, BOT_API_URL, WORKER_COUNT, WORKER_MAX_PENDING
+from user_cache import user_cache
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    # Updates run concurrently, except that updates from the same user run one at a
+    # time in arrival order, so a payment photo and the name typed after it can't
+    # overtake each other.
+    def __init__(self, max_concurrent_updates=WORKER_MAX_PENDING):
+        super().__init__(max_concurrent_updates)
+        self.locks = {}
+
+    async def do_process_update(self, update, coroutine):
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            await coroutine
+            return
+        # [lock, updates holding or waiting on it]; dropped once the user is idle
+        entry = self.locks.get(user.id)
+        if entry is None:
+            entry = self.locks[user.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.locks[user.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+def update_user_id(data):
+    # Sender of a raw update, read straight from the JSON without building an Update
+    for value in data.values():
+        if isinstance(value, dict):
+            sender = value.get('from') or value.get('user')
+            if sender:
+                return sender.get('id')
+    return None
+
+def worker_for(user_id, count):
+    # Reviewers' updates arm and disarm expiry timers, which only worker 0 runs
+    if user_id is None or user_id in ADMIN_IDS:
+        return 0
+    return user_id % count
+
+def worker_main(index, count, inboxes, ready):
+    # The dispatcher decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(run_worker(index, count, inboxes, ready))
+
+async def run_worker(index, count, inboxes, ready):
+    from bot import build_application  # bot imports this module
+    from rate_limiter import rate_limiter
+    from metrics import metrics_server
+
+    rate_limiter.share(count)
+    metrics_server.port += index
+
+    def forward_invalidations(user_ids):
+        # Rows this worker changed may sit in the cache of the worker that owns the user
+        by_worker = {}
+        for user_id in user_ids:
+            target = worker_for(user_id, count)
+            if target != index:
+                by_worker.setdefault(target, []).append(user_id)
+        for target, ids in by_worker.items():
+            try:
+                inboxes[target].put_nowait(('invalidate', ids))
+            except queue.Full:
+                print(f"Worker {target} busy, its cache entries for {ids} expire by TTL")
+
+    user_cache.listeners.append(forward_invalidations)
+
+    # Only one worker runs the expiry timers and proof compaction
+    application = build_application(background_jobs=index == 0)
+    inbox = inboxes[index]
+    slots = asyncio.Semaphore(WORKER_MAX_PENDING)
+
+    async def process(update):
+        try:
+            await application.update_processor.process_update(update, application.process_update(update))
+        finally:
+            slots.release()
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        ready.release()
+
+        while True:
+            await slots.acquire()
+            try:
+                message = inbox.get_nowait()
+            except queue.Empty:
+                message = await asyncio.to_thread(inbox.get)
+            if message is None:
+                break
+            kind, payload = message
+            if kind == 'invalidate':
+                user_cache.invalidate(payload, publish=False)
+                slots.release()
+                continue
+            update = Update.de_json(payload, application.bot)
+            application.create_task(process(update), update=update)
+
+        # Waits for updates still in flight
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+async def poll_telegram(send):
+    kwargs = {'base_url': f"{BOT_API_URL.rstrip('/')}/bot"} if BOT_API_URL else {}
+    async with Bot(BOT_TOKEN, **kwargs) as bot:
+        await bot.delete_webhook()
+        offset = 0
+        try:
+            while True:
+                try:
+                    updates = await bot.get_updates(offset=offset, timeout=10, allowed_updates=Update.ALL_TYPES)
+                except Exception as e:
+                    print(f"Polling error: {e}")
+                    await asyncio.sleep(1)
+                    continue
+                for update in updates:
+                    offset = update.update_id + 1
+                    await send(update.to_dict())
+        finally:
+            # Confirm what was handed to the workers so it isn't redelivered on restart
+            if offset:
+                try:
+                    await bot.get_updates(offset=offset, timeout=0)
+                except Exception as e:
+                    print(f"Error confirming updates: {e}")
+
+async def run_workers(count=WORKER_COUNT, updates=None):
+    # Fetch updates here and hand each to worker user_id % count, so one user's
+    # updates always land on the same process in order. With `updates` (raw update
+    # dicts) the feed is replayed instead of polling Telegram, and the call returns
+    # the seconds taken to process it.
+    context = multiprocessing.get_context('spawn')
+    inboxes = [context.Queue(WORKER_MAX_PENDING * 4) for _ in range(count)]
+    ready = context.Semaphore(0)
+    processes = [
+        context.Process(target=worker_main, args=(index, count, inboxes, ready), name=f"worker-{index}")
+        for index in range(count)
+    ]
+    for process in processes:
+        process.start()
+
+    try:
+        for _ in processes:
+            while not await asyncio.to_thread(ready.acquire, True, 1):
+                if not all(process.is_alive() for process in processes):
+                    raise RuntimeError("A worker process exited during startup")
+        print(f"👷 {count} worker(s) ready")
+
+        async def send(data):
+            message = ('update', data)
+            inbox = inboxes[worker_for(update_user_id(data), count)]
+            try:
+                inbox.put_nowait(message)
+            except queue.Full:
+                await asyncio.to_thread(inbox.put, message)
+
+        started = time.perf_counter()
+        if updates is None:
+            stop = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, stop.set)
+            polling = asyncio.create_task(poll_telegram(send))
+            await asyncio.wait([polling, asyncio.create_task(stop.wait())], return_when=asyncio.FIRST_COMPLETED)
+            polling.cancel()
+            try:
+                await polling
+            except asyncio.CancelledError:
+                pass
+        else:
+            for data in updates:
+                await send(data)
+    finally:
+        for inbox in inboxes:
+            await asyncio.to_thread(inbox.put, None)
+        for process in processes:
+            await asyncio.to_thread(process.join)
+    return time.perf_counter() - started